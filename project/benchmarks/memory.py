@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from core.xlsx_merger import XLSXMerger
+from core.metrics import MergeMetrics
+from benchmarks.synthetic import make_workbook
+
+# Uso (desde project/): python -m benchmarks.memory --rows 5000,20000,80000
+# Combina libros cada vez mas grandes de archivo a archivo (entradas mapeadas, salida en streaming) y reporta el
+# pico de tracemalloc por fase: si el merge no carga el paquete entero, write_zip no crece con el tamano del archivo
+
+def measure(paths, output_path, workers=None):
+    metrics = MergeMetrics(trace_memory=True)
+    try:
+        XLSXMerger.merge_many(paths, output_path, workers=workers, metrics=metrics)
+    finally:
+        metrics.close()
+    return {name: stats['peak_memory'] for name, stats in metrics.phases.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pico de memoria del merge segun el tamano de los libros.")
+    parser.add_argument('--rows', default='5000,20000,80000', help="Filas por hoja de cada corrida, separadas por coma")
+    parser.add_argument('--sources', type=int, default=2)
+    parser.add_argument('--sheets', type=int, default=2)
+    parser.add_argument('--cols', type=int, default=6)
+    parser.add_argument('--strings', type=int, default=500)
+    parser.add_argument('--workers', type=int, help="workers=N para XLSXMerger")
+    parser.add_argument('--output', help="Escribe el JSON en este archivo en vez de stdout")
+    args = parser.parse_args(argv)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in (int(value) for value in args.rows.split(',')):
+            paths = []
+            for seed in range(args.sources):
+                paths.append(os.path.join(tmp, f'input{seed}.xlsx'))
+                with open(paths[-1], 'wb') as f:
+                    f.write(make_workbook(args.sheets, rows, args.cols, args.strings, seed=seed))
+            output_path = os.path.join(tmp, 'output.xlsx')
+            peaks = measure(paths, output_path, args.workers)
+            runs.append({'rows': rows, 'input_bytes': [os.path.getsize(path) for path in paths],
+                         'output_bytes': os.path.getsize(output_path), 'peak_memory': peaks})
+            print(f"{rows} filas: {runs[-1]['output_bytes']} bytes, pico write_zip {peaks.get('write_zip')}",
+                  file=sys.stderr)
+
+    report = {'config': {name: getattr(args, name) for name in ('sources', 'sheets', 'cols', 'strings', 'workers')},
+              'runs': runs}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
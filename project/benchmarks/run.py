@@ -0,0 +1,166 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+from core.xlsx_merger import XLSXMerger
+from core.zip_handler import FAST_COMPRESSION_LEVELS
+from core.metrics import MergeMetrics
+from core.xml_utils import xml_cache
+from benchmarks.synthetic import make_workbook
+
+# Uso (desde project/): python -m benchmarks.run --sheets 4 --rows 5000 --images 2 --charts 1 --output bench.json
+# Las hojas se reescriben en streaming al escribir el zip, asi que ese costo aparece dentro de write_zip
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+
+def run_xlsx_merger(sources, workers=None, compression_levels=None, trace_memory=False):
+    # Las fases salen de los hooks de core.metrics; con trace_memory tambien el pico de memoria de cada una
+    metrics = MergeMetrics(trace_memory)
+    start = time.perf_counter()
+    try:
+        output = XLSXMerger.merge_many(sources, workers=workers, compression_levels=compression_levels, metrics=metrics)
+    finally:
+        metrics.close()
+    timings = {name: stats['seconds'] for name, stats in metrics.phases.items()}
+    timings['total'] = time.perf_counter() - start
+    if trace_memory:
+        timings['peak_memory'] = max(stats['peak_memory'] or 0 for stats in metrics.phases.values())
+    return timings, output
+
+def run_algo(sources):
+    # tests/algo.py combina de a dos libros y no puede volver a leer su propio workbook.xml (lo escribe sin el
+    # namespace main), asi que no se puede encadenar: solo se miden los dos primeros origenes
+    sys.path.insert(0, str(_REPO_ROOT / 'tests'))
+    try:
+        import algo
+    finally:
+        sys.path.pop(0)
+    timings = {}
+    start = time.perf_counter()
+    contents = []
+    for source in sources[:2]:
+        with zipfile.ZipFile(io.BytesIO(source)) as z:
+            contents.append({name: z.read(name) for name in z.namelist()})
+    timings['extract'] = time.perf_counter() - start
+    t = time.perf_counter()
+    merged = algo.merge_workbooks(*contents)
+    timings['merge_workbooks'] = time.perf_counter() - t
+    t = time.perf_counter()
+    output = io.BytesIO()
+    algo.write_xlsx(output, merged)
+    timings['write_xlsx'] = time.perf_counter() - t
+    timings['total'] = time.perf_counter() - start
+    return timings, output.getvalue()
+
+def run_aspose(sources):
+    # Las mismas llamadas que src/merge.py (Workbook.combine), con archivos temporales porque aspose lee rutas
+    import aspose.cells as cells
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i, source in enumerate(sources):
+            paths.append(os.path.join(tmp, f'input{i}.xlsx'))
+            with open(paths[-1], 'wb') as f:
+                f.write(source)
+        output_path = os.path.join(tmp, 'output.xlsx')
+        timings = {}
+        start = time.perf_counter()
+        books = [cells.Workbook(path) for path in paths]
+        timings['load'] = time.perf_counter() - start
+        t = time.perf_counter()
+        for book in books[1:]:
+            books[0].combine(book)
+        timings['combine'] = time.perf_counter() - t
+        t = time.perf_counter()
+        books[0].save(output_path)
+        timings['save'] = time.perf_counter() - t
+        timings['total'] = time.perf_counter() - start
+        with open(output_path, 'rb') as f:
+            return timings, f.read()
+
+def _summarize(runs):
+    # runs: lista de (timings, output); por fase se reporta min, mediana y max en segundos (bytes para peak_memory)
+    phases = {}
+    for timings, _ in runs:
+        for name, seconds in timings.items():
+            phases.setdefault(name, []).append(seconds)
+    return {
+        'phases': {name: {'min': round(min(values), 6), 'median': round(statistics.median(values), 6),
+                          'max': round(max(values), 6)} for name, values in phases.items()},
+        'output_bytes': len(runs[-1][1]),
+    }
+
+def benchmark(implementations, sources, repeat=5, warmup=1):
+    results = {}
+    for name, run in implementations.items():
+        try:
+            for _ in range(warmup):
+                run(sources)
+            results[name] = _summarize([run(sources) for _ in range(repeat)])
+        except ImportError as e:
+            results[name] = {'skipped': f"{type(e).__name__}: {e}"}
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del merge de libros .xlsx con libros sinteticos.")
+    parser.add_argument('--sources', type=int, default=2, help="Cantidad de libros a combinar")
+    parser.add_argument('--sheets', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--cols', type=int, default=6)
+    parser.add_argument('--strings', type=int, default=500, help="sharedStrings unicos por libro")
+    parser.add_argument('--images', type=int, default=1, help="Imagenes por hoja")
+    parser.add_argument('--charts', type=int, default=1, help="Graficos por hoja")
+    parser.add_argument('--formulas', action='store_true', help="Agrega una columna de formulas por hoja")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--workers', type=int, help="workers=N para XLSXMerger")
+    parser.add_argument('--fast', action='store_true', help="Usa FAST_COMPRESSION_LEVELS en XLSXMerger")
+    parser.add_argument('--trace-memory', action='store_true', help="Reporta el pico de tracemalloc de XLSXMerger")
+    parser.add_argument('--baselines', default='algo,aspose', help="Baselines a comparar, separados por coma")
+    parser.add_argument('--output', help="Escribe el JSON en este archivo en vez de stdout")
+    args = parser.parse_args(argv)
+
+    config = {name: getattr(args, name) for name in ('sources', 'sheets', 'rows', 'cols', 'strings', 'images',
+                                                      'charts', 'formulas', 'repeat', 'warmup', 'workers', 'fast',
+                                                      'trace_memory')}
+    sources = [make_workbook(args.sheets, args.rows, args.cols, args.strings, args.images, args.charts,
+                             args.formulas, seed=seed) for seed in range(args.sources)]
+
+    compression_levels = FAST_COMPRESSION_LEVELS if args.fast else None
+    implementations = {'xlsx_merger': lambda s: run_xlsx_merger(s, args.workers, compression_levels, args.trace_memory)}
+    baselines = {'algo': run_algo, 'aspose': run_aspose}
+    for name in filter(None, args.baselines.split(',')):
+        implementations[name] = baselines[name]
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': config,
+        'input_bytes': [len(source) for source in sources],
+        'results': benchmark(implementations, sources, args.repeat, args.warmup),
+        'xml_cache': xml_cache.stats(),
+    }
+    if 'phases' in report['results'].get('algo', {}) and args.sources > 2:
+        report['results']['algo']['sources'] = 2
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    for name, result in report['results'].items():
+        total = result.get('phases', {}).get('total')
+        summary = f"{total['median']:.4f}s (mediana)" if total else result.get('skipped', '')
+        print(f"{name}: {summary}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
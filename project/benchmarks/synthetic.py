@@ -0,0 +1,157 @@
+import io
+import struct
+import zipfile
+import zlib
+from core.xml_utils import NS_MAIN, NS_REL, NS_PKG_REL, NS_CT
+
+# Libros sinteticos armados a mano (sin openpyxl ni Pillow) para poder generar archivos grandes rapido.
+# Cada seed cambia la mitad de los sharedStrings y el formato numerico, asi los mapas del merge no son la identidad
+
+NS_XDR = 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing'
+NS_A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+NS_C = 'http://schemas.openxmlformats.org/drawingml/2006/chart'
+_REL_BASE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_CT_BASE = 'application/vnd.openxmlformats-officedocument'
+
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+def column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def make_png(width, height, rgb):
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    row = b'\x00' + bytes(rgb) * width
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height)) + chunk(b'IEND', b''))
+
+def _sheet_xml(sheet_index, rows, cols, strings, formulas, has_drawing):
+    out = [f'{_XML_DECL}<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}"><sheetData>']
+    for r in range(1, rows + 1):
+        cells = []
+        for c in range(cols):
+            ref = f'{column_letter(c)}{r}'
+            if r == 1 or c % 2 == 0:
+                cells.append(f'<c r="{ref}" t="s" s="{1 if r == 1 else 0}"><v>{(r * cols + c) % max(strings, 1)}</v></c>')
+            else:
+                cells.append(f'<c r="{ref}" s="2"><v>{r * c + sheet_index}.5</v></c>')
+        if formulas:
+            cells.append(f'<c r="{column_letter(cols)}{r}"><f>\'Hoja{sheet_index}\'!B{r}*2</f></c>')
+        out.append(f'<row r="{r}">{"".join(cells)}</row>')
+    out.append('</sheetData>')
+    if has_drawing:
+        out.append('<drawing r:id="rId1"/>')
+    out.append('</worksheet>')
+    return ''.join(out).encode('utf-8')
+
+def _anchor(position, inner, cx, cy):
+    return (f'<xdr:oneCellAnchor><xdr:from><xdr:col>{position * 6}</xdr:col><xdr:colOff>0</xdr:colOff>'
+            f'<xdr:row>0</xdr:row><xdr:rowOff>0</xdr:rowOff></xdr:from><xdr:ext cx="{cx}" cy="{cy}"/>'
+            f'{inner}<xdr:clientData/></xdr:oneCellAnchor>')
+
+def _drawing_xml(images, charts):
+    anchors = []
+    for i in range(images):
+        anchors.append(_anchor(i, f'<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="{i + 2}" name="Imagen {i + 1}"/><xdr:cNvPicPr/>'
+                                  f'</xdr:nvPicPr><xdr:blipFill><a:blip r:embed="rId{i + 1}"/><a:stretch><a:fillRect/>'
+                                  f'</a:stretch></xdr:blipFill><xdr:spPr><a:prstGeom prst="rect"><a:avLst/></a:prstGeom>'
+                                  f'</xdr:spPr></xdr:pic>', 952500, 952500))
+    for i in range(charts):
+        anchors.append(_anchor(images + i, f'<xdr:graphicFrame macro=""><xdr:nvGraphicFramePr>'
+                                           f'<xdr:cNvPr id="{images + i + 2}" name="Grafico {i + 1}"/><xdr:cNvGraphicFramePr/>'
+                                           f'</xdr:nvGraphicFramePr><xdr:xfrm><a:off x="0" y="0"/><a:ext cx="0" cy="0"/>'
+                                           f'</xdr:xfrm><a:graphic><a:graphicData uri="{NS_C}">'
+                                           f'<c:chart r:id="rId{images + i + 1}"/></a:graphicData></a:graphic>'
+                                           f'</xdr:graphicFrame>', 4572000, 2743200))
+    return (f'{_XML_DECL}<xdr:wsDr xmlns:xdr="{NS_XDR}" xmlns:a="{NS_A}" xmlns:r="{NS_REL}" xmlns:c="{NS_C}">'
+            f'{"".join(anchors)}</xdr:wsDr>').encode('utf-8')
+
+def _chart_xml(sheet_index, rows):
+    return (f'{_XML_DECL}<c:chartSpace xmlns:c="{NS_C}" xmlns:a="{NS_A}" xmlns:r="{NS_REL}"><c:chart><c:plotArea>'
+            f'<c:layout/><c:barChart><c:barDir val="col"/><c:grouping val="clustered"/><c:ser><c:idx val="0"/>'
+            f'<c:order val="0"/><c:val><c:numRef><c:f>\'Hoja{sheet_index}\'!$B$2:$B${max(rows, 2)}</c:f></c:numRef>'
+            f'</c:val></c:ser><c:axId val="10"/><c:axId val="20"/></c:barChart><c:catAx><c:axId val="10"/>'
+            f'<c:scaling><c:orientation val="minMax"/></c:scaling><c:axPos val="b"/><c:crossAx val="20"/></c:catAx>'
+            f'<c:valAx><c:axId val="20"/><c:scaling><c:orientation val="minMax"/></c:scaling><c:axPos val="l"/>'
+            f'<c:crossAx val="10"/></c:valAx></c:plotArea></c:chart></c:chartSpace>').encode('utf-8')
+
+def _styles_xml(seed):
+    return (f'{_XML_DECL}<styleSheet xmlns="{NS_MAIN}"><numFmts count="1">'
+            f'<numFmt numFmtId="164" formatCode="0.{"0" * (seed % 4 + 1)}"/></numFmts>'
+            f'<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+            f'<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+            f'<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+            f'<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            f'<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            f'<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            f'<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+            f'<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+            f'<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>').encode('utf-8')
+
+def _rels_xml(relationships):
+    body = ''.join(f'<Relationship Id="rId{i}" Type="{_REL_BASE}/{type_}" Target="{target}"/>'
+                   for i, (type_, target) in enumerate(relationships, 1))
+    return f'{_XML_DECL}<Relationships xmlns="{NS_PKG_REL}">{body}</Relationships>'.encode('utf-8')
+
+def make_workbook(sheets=1, rows=100, cols=6, strings=50, images=0, charts=0, formulas=False, image_px=64, seed=0):
+    # Devuelve los bytes de un .xlsx; images y charts son por hoja
+    parts = {}
+    overrides = {'/xl/workbook.xml': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml',
+                 '/xl/styles.xml': f'{_CT_BASE}.spreadsheetml.styles+xml',
+                 '/xl/sharedStrings.xml': f'{_CT_BASE}.spreadsheetml.sharedStrings+xml'}
+    string_offset = seed * strings // 2
+    workbook_rels = []
+    sheet_entries = []
+    image_number = chart_number = 0
+    for s in range(1, sheets + 1):
+        has_drawing = bool(images or charts)
+        parts[f'xl/worksheets/sheet{s}.xml'] = _sheet_xml(s, rows, cols, strings, formulas, has_drawing)
+        overrides[f'/xl/worksheets/sheet{s}.xml'] = f'{_CT_BASE}.spreadsheetml.worksheet+xml'
+        workbook_rels.append(('worksheet', f'worksheets/sheet{s}.xml'))
+        sheet_entries.append(f'<sheet name="Hoja{s}" sheetId="{s}" r:id="rId{s}"/>')
+        if not has_drawing:
+            continue
+        parts[f'xl/worksheets/_rels/sheet{s}.xml.rels'] = _rels_xml([('drawing', f'../drawings/drawing{s}.xml')])
+        parts[f'xl/drawings/drawing{s}.xml'] = _drawing_xml(images, charts)
+        overrides[f'/xl/drawings/drawing{s}.xml'] = f'{_CT_BASE}.drawing+xml'
+        drawing_rels = []
+        for _ in range(images):
+            image_number += 1
+            # Una de cada dos imagenes se repite entre seeds para que la deduplicacion de media tenga trabajo
+            color = (image_number * 37 % 256, (seed if image_number % 2 else 0) * 53 % 256, 128)
+            parts[f'xl/media/image{image_number}.png'] = make_png(image_px, image_px, color)
+            drawing_rels.append(('image', f'../media/image{image_number}.png'))
+        for _ in range(charts):
+            chart_number += 1
+            parts[f'xl/charts/chart{chart_number}.xml'] = _chart_xml(s, rows)
+            overrides[f'/xl/charts/chart{chart_number}.xml'] = 'application/vnd.openxmlformats-officedocument.drawingml.chart+xml'
+            drawing_rels.append(('chart', f'../charts/chart{chart_number}.xml'))
+        parts[f'xl/drawings/_rels/drawing{s}.xml.rels'] = _rels_xml(drawing_rels)
+
+    workbook_rels += [('styles', 'styles.xml'), ('sharedStrings', 'sharedStrings.xml')]
+    parts['xl/workbook.xml'] = (f'{_XML_DECL}<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}"><sheets>'
+                                f'{"".join(sheet_entries)}</sheets></workbook>').encode('utf-8')
+    parts['xl/_rels/workbook.xml.rels'] = _rels_xml(workbook_rels)
+    parts['xl/styles.xml'] = _styles_xml(seed)
+    items = ''.join(f'<si><t>texto {string_offset + i}</t></si>' for i in range(max(strings, 1)))
+    parts['xl/sharedStrings.xml'] = (f'{_XML_DECL}<sst xmlns="{NS_MAIN}" count="{max(strings, 1)}" '
+                                     f'uniqueCount="{max(strings, 1)}">{items}</sst>').encode('utf-8')
+    parts['_rels/.rels'] = (f'{_XML_DECL}<Relationships xmlns="{NS_PKG_REL}"><Relationship Id="rId1" '
+                            f'Type="{_REL_BASE}/officeDocument" Target="xl/workbook.xml"/></Relationships>').encode('utf-8')
+
+    defaults = ('<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/><Default Extension="png" ContentType="image/png"/>')
+    override_xml = ''.join(f'<Override PartName="{name}" ContentType="{type_}"/>' for name, type_ in overrides.items())
+    content_types = f'{_XML_DECL}<Types xmlns="{NS_CT}">{defaults}{override_xml}</Types>'.encode('utf-8')
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', content_types)
+        for path, data in parts.items():
+            z.writestr(path, data)
+    return output.getvalue()
@@ -0,0 +1,121 @@
+import asyncio
+import io
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from core.xlsx_merger import XLSXMerger
+from core.zip_handler import replace_on_success
+
+_CANCEL_POLL = 0.05  # segundos entre chequeos de cancelacion mientras se espera una entrada async
+
+class MergeCancelled(Exception):
+    pass
+
+class _CancellableWriter:
+    # Envuelve la salida para que un merge cancelado se corte en el proximo write, aunque ya este escribiendo el zip
+    def __init__(self, fileobj, cancelled):
+        self.fileobj = fileobj
+        self.cancelled = cancelled
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise MergeCancelled()
+        return self.fileobj.write(data)
+
+async def read_source(source):
+    # bytes, una ruta, un stream async con read() (StreamReader, UploadFile, aiofiles) o un iterable async de chunks.
+    # Las rutas pasan tal cual: ZipHandler las mapea en memoria sin leerlas al heap
+    if isinstance(source, (bytes, bytearray, memoryview, str, os.PathLike)):
+        return source
+    if hasattr(source, 'read'):
+        return await source.read()
+    if hasattr(source, '__aiter__'):
+        return b''.join([chunk async for chunk in source])
+    raise TypeError(f"Unsupported merge source: {type(source).__name__}")
+
+def _read_sources(sources, loop, cancelled):
+    # Corre en el hilo del merge: cada entrada se lee en el event loop recien cuando el merger la necesita
+    for source in sources:
+        if cancelled.is_set():
+            raise MergeCancelled()
+        read = asyncio.run_coroutine_threadsafe(read_source(source), loop)
+        while True:
+            try:
+                yield read.result(timeout=_CANCEL_POLL)
+                break
+            except FutureTimeoutError:
+                if cancelled.is_set():
+                    read.cancel()
+                    raise MergeCancelled()
+
+def _merge_blocking(sources, output, cancelled, merger_options, template_cache=None):
+    if template_cache is not None:
+        # El primer origen es el libro base: se busca (o se prepara) en el cache y el resto sigue igual.
+        # Sin origenes el chain queda vacio y merge_many levanta el ValueError
+        sources = iter(sources)
+        sources = itertools.chain((template_cache.get(base) for base in itertools.islice(sources, 1)), sources)
+    if isinstance(output, (str, os.PathLike)):
+        # Un merge cancelado o fallido deja output como estaba (puede ser tambien una de las entradas)
+        with replace_on_success(output) as f:
+            XLSXMerger.merge_many(sources, _CancellableWriter(f, cancelled), **merger_options)
+        return None
+    target = io.BytesIO() if output is None else output
+    XLSXMerger.merge_many(sources, _CancellableWriter(target, cancelled), **merger_options)
+    return target.getvalue() if output is None else None
+
+class AsyncMergeService:
+    # Fachada async de XLSXMerger: el merge corre en un pool de hilos y a lo sumo max_concurrency a la vez.
+    # Con workers=N cada merge reparte ademas la reescritura de hojas en procesos (ver XLSXMerger).
+    # Con template_cache (un core.template_cache.TemplateCache) el libro base de cada merge se reusa entre pedidos
+    def __init__(self, max_concurrency=4, executor=None, template_cache=None, **merger_options):
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self.template_cache = template_cache
+        self.merger_options = merger_options
+        self._semaphore = None
+        self._loop = None
+
+    async def merge(self, sources, output=None):
+        # Devuelve los bytes del libro combinado, o None si output es una ruta o un stream con write()
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # El semaforo queda atado al event loop que lo usa primero
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='xlsx-merge')
+        async with self._semaphore:
+            cancelled = threading.Event()
+            future = self.executor.submit(_merge_blocking, _read_sources(sources, loop, cancelled), output,
+                                          cancelled, self.merger_options, self.template_cache)
+            result = asyncio.wrap_future(future)
+            try:
+                return await asyncio.shield(result)
+            except asyncio.CancelledError:
+                # El hilo no se puede matar: se le avisa y se espera a que corte antes de liberar el cupo
+                cancelled.set()
+                future.cancel()
+                await asyncio.wait([result])
+                if not result.cancelled():
+                    result.exception()
+                raise
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+_default_service = None
+
+async def merge_async(sources, output=None, **merger_options):
+    # Atajo sobre un AsyncMergeService compartido; para otro limite de concurrencia se crea un servicio propio
+    global _default_service
+    if merger_options:
+        service = AsyncMergeService(**merger_options)
+        try:
+            return await service.merge(sources, output)
+        finally:
+            service.close()
+    if _default_service is None:
+        _default_service = AsyncMergeService()
+    return await _default_service.merge(sources, output)
@@ -0,0 +1,42 @@
+import posixpath
+from core.xml_utils import parse_xml_shared, escape_attr, NS_CT
+
+CT_WORKSHEET = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+
+class ContentTypes:
+    def __init__(self, xml_bytes=None):
+        self.defaults = {}   # extension -> content type
+        self.overrides = {}  # '/xl/...' -> content type
+        if xml_bytes:
+            _, root = parse_xml_shared(xml_bytes)
+            for default in root.findall(f'{{{NS_CT}}}Default'):
+                self.defaults[default.attrib['Extension'].lower()] = default.attrib['ContentType']
+            for override in root.findall(f'{{{NS_CT}}}Override'):
+                self.overrides[override.attrib['PartName']] = override.attrib['ContentType']
+
+    def get(self, part_path):
+        part_name = '/' + part_path.lstrip('/')
+        if part_name in self.overrides:
+            return self.overrides[part_name]
+        # No splitext: para '_rels/.rels' la extension es 'rels' y no ''
+        name = posixpath.basename(part_name)
+        ext = name.rsplit('.', 1)[1].lower() if '.' in name else ''
+        return self.defaults.get(ext)
+
+    def add_default(self, extension, content_type):
+        self.defaults.setdefault(extension.lower(), content_type)
+
+    def add_override(self, part_path, content_type):
+        self.overrides['/' + part_path.lstrip('/')] = content_type
+
+    def remove_override(self, part_path):
+        self.overrides.pop('/' + part_path.lstrip('/'), None)
+
+    def to_bytes(self):
+        lines = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Types xmlns="{NS_CT}">']
+        for ext, content_type in self.defaults.items():
+            lines.append(f'<Default Extension="{escape_attr(ext)}" ContentType="{escape_attr(content_type)}"/>')
+        for part_name, content_type in self.overrides.items():
+            lines.append(f'<Override PartName="{escape_attr(part_name)}" ContentType="{escape_attr(content_type)}"/>')
+        lines.append('</Types>')
+        return ''.join(lines).encode('utf-8')
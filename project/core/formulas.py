@@ -0,0 +1,21 @@
+import re
+
+# Un literal "..." se deja intacto; si no, un nombre de hoja (entre comillas o no) seguido de '!'
+_SHEET_REFERENCE = re.compile(r"(\"[^\"]*\")|(?<![\w.\]'])('(?:[^']|'')+'|[^\W\d][\w.]*)(?=!)")
+
+def quote_sheet_name(name):
+    return "'" + name.replace("'", "''") + "'"
+
+def rename_sheet_references(formula, renames):
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        reference = match.group(2)
+        name = reference[1:-1].replace("''", "'") if reference.startswith("'") else reference
+        new_name = renames.get(name)
+        return reference if new_name is None else quote_sheet_name(new_name)
+    return _SHEET_REFERENCE.sub(replace, formula)
+
+def formula_callback(renames):
+    # Callback de texto para <f> (celdas y <c:f> de los charts) cuando el merge renombra hojas del origen
+    return lambda text, parent_attrs: rename_sheet_references(text, renames) if text else text
@@ -0,0 +1,67 @@
+import contextlib
+import time
+import tracemalloc
+
+# Instrumentacion de XLSXMerger y ZipHandler. Un "sink" es cualquier callable
+#   sink(fase, segundos, bytes_in=0, bytes_out=0, parts=0, peak_memory=None)
+# (por ejemplo una funcion que manda a statsd); MergeMetrics es el que acumula en memoria.
+# Si el sink tiene trace_memory=True cada fase reporta el pico de tracemalloc, que tiene que estar activo.
+
+_DISABLED = contextlib.nullcontext()
+
+class Phase:
+    __slots__ = ('sink', 'name', 'bytes_in', 'bytes_out', 'parts', '_start', '_trace')
+
+    def __init__(self, sink, name, bytes_in=0, bytes_out=0, parts=0):
+        self.sink = sink
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.parts = parts
+
+    def __enter__(self):
+        self._trace = getattr(self.sink, 'trace_memory', False) and tracemalloc.is_tracing()
+        if self._trace:
+            tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._start
+        peak_memory = tracemalloc.get_traced_memory()[1] if self._trace else None
+        self.sink(self.name, seconds, bytes_in=self.bytes_in, bytes_out=self.bytes_out,
+                  parts=self.parts, peak_memory=peak_memory)
+
+def phase(sink, name, **counts):
+    # Sin sink devuelve siempre el mismo nullcontext: no se mide ni se crea nada, y `as` da None
+    return _DISABLED if sink is None else Phase(sink, name, **counts)
+
+class MergeMetrics:
+    # Sink por defecto: acumula por fase llamadas, segundos, bytes, partes y el mayor pico de memoria
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def __call__(self, name, seconds, bytes_in=0, bytes_out=0, parts=0, peak_memory=None):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = {'calls': 0, 'seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0,
+                                         'parts': 0, 'peak_memory': None}
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['bytes_in'] += bytes_in
+        stats['bytes_out'] += bytes_out
+        stats['parts'] += parts
+        if peak_memory is not None:
+            stats['peak_memory'] = max(stats['peak_memory'] or 0, peak_memory)
+
+    def to_dict(self):
+        return {name: dict(stats) for name, stats in self.phases.items()}
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
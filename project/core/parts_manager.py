@@ -0,0 +1,146 @@
+import hashlib
+import posixpath
+import re
+from core.rels_manager import RelsIndex, rels_path_for, resolve_target, relative_target
+from core.styles import remap_dxf_ids
+from core.xml_utils import parse_xml_bytes, parse_xml_shared, write_xml_to_bytes, IdAllocator
+
+CT_TABLE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.table+xml'
+
+_PART_NAME = re.compile(r'^(.*?)(\d*)(\.[^./]*)?$')
+
+class PartsManager:
+    # Copia en memoria una parte y todo lo que cuelga de sus _rels (drawings, charts, media, comments, tables...)
+    def __init__(self, output_zip, content_types):
+        self.output_zip = output_zip
+        self.content_types = content_types
+        self.part_numbers = {}  # (prefijo, extension) -> proximo numero libre
+        self.table_ids = None
+        self.table_names = None
+        self.media_index = None  # (CRC-32, tamaño) -> [(digest o None, ruta en la salida)]
+
+    def allocate_part_name(self, src_path):
+        prefix, _, ext = _PART_NAME.match(src_path).groups()
+        ext = ext or ''
+        family = (prefix, ext)
+        if family not in self.part_numbers:
+            self.part_numbers[family] = self._seed_part_number(prefix, ext)
+        number = self.part_numbers[family]
+        while f"{prefix}{number}{ext}" in self.output_zip.files:
+            number += 1
+        self.part_numbers[family] = number + 1
+        return f"{prefix}{number}{ext}"
+
+    def _seed_part_number(self, prefix, ext):
+        highest = 0
+        for path in self.output_zip.files:
+            if path.startswith(prefix) and path.endswith(ext):
+                digits = path[len(prefix):len(path) - len(ext)]
+                if digits.isdigit():
+                    highest = max(highest, int(digits))
+        return highest + 1
+
+    def copy_part_graph(self, zip_src, src_ct, src_part, dst_part, part_map, dxf_map=None):
+        # part_map (origen -> destino) se comparte por origen para copiar una sola vez las partes referenciadas varias veces.
+        # dxf_map (ver StylesTable.merge_from) remapea los dxfId de las tablas copiadas
+        part_map[src_part] = dst_part
+        self.copy_part(zip_src, src_ct, src_part, dst_part, dxf_map)
+        pending = [(src_part, dst_part)]
+        while pending:
+            src_path, dst_path = pending.pop()
+            src_rels_path = rels_path_for(src_path)
+            if src_rels_path not in zip_src.files:
+                continue
+            rels = RelsIndex(zip_src.get_file_content(src_rels_path))
+            changed = False
+            for r_id, (_, target, target_mode) in list(rels.relationships.items()):
+                if target_mode == 'External':
+                    continue
+                src_target = resolve_target(src_path, target)
+                if src_target not in zip_src.files:
+                    continue
+                dst_target = part_map.get(src_target)
+                if dst_target is None and src_target.startswith('xl/media/'):
+                    dst_target = part_map[src_target] = self.copy_media(zip_src, src_ct, src_target)
+                elif dst_target is None:
+                    dst_target = part_map[src_target] = self.allocate_part_name(src_target)
+                    self.copy_part(zip_src, src_ct, src_target, dst_target, dxf_map)
+                    pending.append((src_target, dst_target))
+                new_target = '/' + dst_target if target.startswith('/') else relative_target(dst_path, dst_target)
+                if new_target != target:
+                    rels.set_target(r_id, new_target)
+                    changed = True
+            dst_rels_path = rels_path_for(dst_path)
+            if changed:
+                self.output_zip.set_file_content(dst_rels_path, rels.to_bytes())
+            else:
+                self.output_zip.copy_file_from(zip_src, src_rels_path, dst_rels_path)
+        return dst_part
+
+    def copy_part(self, zip_src, src_ct, src_path, dst_path, dxf_map=None):
+        content_type = src_ct.get(src_path)
+        if content_type == CT_TABLE:
+            self.output_zip.set_file_content(dst_path, self.renumber_table(zip_src.get_file_content(src_path), dxf_map))
+        else:
+            self.output_zip.copy_file_from(zip_src, src_path, dst_path)
+        if content_type is None:
+            return
+        if ('/' + src_path) not in src_ct.overrides:
+            self.content_types.add_default(posixpath.splitext(src_path)[1][1:], content_type)
+        if self.content_types.get(dst_path) != content_type:
+            self.content_types.add_override(dst_path, content_type)
+
+    def copy_media(self, zip_src, src_ct, src_path):
+        # Las imagenes se direccionan por contenido: si ya hay una identica en la salida se reutiliza esa parte.
+        # CRC y tamaño salen del directorio central, asi que solo se descomprime y hashea ante un posible duplicado
+        if self.media_index is None:
+            self.media_index = {}
+            for path in self.output_zip.files:
+                if path.startswith('xl/media/'):
+                    self.media_index.setdefault(self.output_zip.get_file_checksum(path), []).append([None, path])
+        candidates = self.media_index.setdefault(zip_src.get_file_checksum(src_path), [])
+        if candidates:
+            digest = self._media_digest(zip_src, src_path)
+            for candidate in candidates:
+                if candidate[0] is None:
+                    candidate[0] = self._media_digest(self.output_zip, candidate[1])
+                if candidate[0] == digest and posixpath.splitext(candidate[1])[1] == posixpath.splitext(src_path)[1]:
+                    return candidate[1]
+        dst_path = self.allocate_part_name(src_path)
+        self.copy_part(zip_src, src_ct, src_path, dst_path)
+        candidates.append([None, dst_path])
+        return dst_path
+
+    def _media_digest(self, zip_handler, path):
+        return hashlib.sha256(zip_handler.get_file_content(path, cache=False)).digest()
+
+    def renumber_table(self, table_bytes, dxf_map=None):
+        # id, name y displayName de las tablas tienen que ser unicos en todo el libro
+        if self.table_ids is None:
+            self._seed_tables()
+        tree, root = parse_xml_bytes(table_bytes)
+        root.attrib['id'] = self.table_ids.new_id()
+        for attr in ('name', 'displayName'):
+            name = root.attrib.get(attr)
+            if name is None:
+                continue
+            new_name, i = name, 1
+            while new_name in self.table_names[attr]:
+                new_name = f"{name}_{i}"
+                i += 1
+            root.attrib[attr] = new_name
+            self.table_names[attr].add(new_name)
+        if dxf_map is not None:
+            remap_dxf_ids(root, dxf_map)
+        return write_xml_to_bytes(tree)
+
+    def _seed_tables(self):
+        self.table_ids = IdAllocator(prefix='')
+        self.table_names = {'name': set(), 'displayName': set()}
+        for path in list(self.output_zip.files):
+            if self.content_types.get(path) == CT_TABLE:
+                _, root = parse_xml_shared(self.output_zip.get_file_content(path))
+                self.table_ids.reserve(root.attrib.get('id', ''))
+                for attr in ('name', 'displayName'):
+                    if attr in root.attrib:
+                        self.table_names[attr].add(root.attrib[attr])
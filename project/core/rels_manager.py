@@ -1,18 +1,23 @@
 import os
+import posixpath
 import xml.etree.ElementTree as ET
-from core.xml_utils import parse_xml, write_xml, generate_unique_id
+from core.xml_utils import parse_xml, write_xml, parse_xml_shared, escape_attr, IdAllocator, NS_PKG_REL
 
 class RelsManager:
-    def __init__(self, rels_path):
+    def __init__(self, rels_path, id_allocator=None):
         self.rels_path = rels_path
         self.tree, self.root = parse_xml(rels_path)
+        self.id_allocator = id_allocator or IdAllocator()
+        for r_id in self.get_existing_ids():
+            self.id_allocator.reserve(r_id)
 
     def list_relationships(self):
         return [rel.attrib for rel in self.root.findall('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship')]
 
     def add_relationship(self, Id, Type, Target):
-        rel = ET.Element('Relationship', Id=Id, Type=Type, Target=Target)
+        rel = ET.Element(f'{{{NS_PKG_REL}}}Relationship', Id=Id, Type=Type, Target=Target)
         self.root.append(rel)
+        self.id_allocator.reserve(Id)
 
     def save(self):
         write_xml(self.tree, self.rels_path)
@@ -21,4 +26,67 @@ class RelsManager:
         return {rel.attrib['Id'] for rel in self.root.findall('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship')}
 
     def generate_new_id(self):
-        return generate_unique_id(self.get_existing_ids())
+        return self.id_allocator.new_id()
+
+
+def rels_path_for(part_path):
+    folder, name = posixpath.split(part_path)
+    return posixpath.join(folder, '_rels', f"{name}.rels")
+
+def resolve_target(part_path, target):
+    # Los Target son relativos a la carpeta de la parte origen, o absolutos desde la raiz del paquete
+    if target.startswith('/'):
+        return posixpath.normpath(target.lstrip('/'))
+    return posixpath.normpath(posixpath.join(posixpath.dirname(part_path), target))
+
+def relative_target(part_path, target_path):
+    return posixpath.relpath(target_path, posixpath.dirname(part_path) or '.')
+
+class RelsIndex:
+    # Indice en memoria de un .rels: se parsea una vez, se modifica in situ y se serializa al final
+    def __init__(self, rels_bytes=None, id_allocator=None):
+        self.relationships = {}  # Id -> (Type, Target, TargetMode)
+        self.by_target = {}      # Target -> Id
+        self.id_allocator = id_allocator or IdAllocator()
+        if rels_bytes:
+            _, root = parse_xml_shared(rels_bytes)
+            for rel in root.findall(f'{{{NS_PKG_REL}}}Relationship'):
+                self._register(rel.attrib['Id'], rel.attrib['Type'], rel.attrib['Target'], rel.attrib.get('TargetMode'))
+
+    def _register(self, r_id, type_, target, target_mode=None):
+        self.relationships[r_id] = (type_, target, target_mode)
+        self.by_target.setdefault(target, r_id)
+        self.id_allocator.reserve(r_id)
+
+    def target(self, r_id):
+        rel = self.relationships.get(r_id)
+        return rel[1] if rel else None
+
+    def find_by_type(self, type_):
+        for r_id, (rel_type, target, _) in self.relationships.items():
+            if rel_type == type_:
+                return r_id, target
+        return None
+
+    def rid_for(self, target):
+        return self.by_target.get(target)
+
+    def set_target(self, r_id, target):
+        type_, old_target, target_mode = self.relationships[r_id]
+        if self.by_target.get(old_target) == r_id:
+            del self.by_target[old_target]
+        self.relationships[r_id] = (type_, target, target_mode)
+        self.by_target.setdefault(target, r_id)
+
+    def add(self, type_, target, target_mode=None):
+        r_id = self.id_allocator.new_id()
+        self._register(r_id, type_, target, target_mode)
+        return r_id
+
+    def to_bytes(self):
+        lines = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{NS_PKG_REL}">']
+        for r_id, (type_, target, target_mode) in self.relationships.items():
+            mode = f' TargetMode="{escape_attr(target_mode)}"' if target_mode else ''
+            lines.append(f'<Relationship Id="{escape_attr(r_id)}" Type="{escape_attr(type_)}" Target="{escape_attr(target)}"{mode}/>')
+        lines.append('</Relationships>')
+        return ''.join(lines).encode('utf-8')
@@ -0,0 +1,102 @@
+import re
+from core.xml_utils import NS_MAIN
+
+REL_SHARED_STRINGS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings'
+CT_SHARED_STRINGS = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml'
+
+# El namespace main puede venir con prefijo (<x:sst><x:si>..., tipico de OpenXML SDK): se detecta en la raiz y los
+# <si> se guardan sin prefijo, para deduplicar contra los de otras tablas y escribirlos bajo el <sst> sin prefijo
+_SST_ROOT = re.compile(rb'<([\w.-]+:)?sst\b[^>]*>')
+_SST_COUNT = re.compile(rb'\bcount="(\d+)"')
+_ANY_SI = re.compile(rb'<(?:[\w.-]+:)?si\b')
+_SI_PATTERNS = {}
+
+def _si_pattern(prefix):
+    pattern = _SI_PATTERNS.get(prefix)
+    if pattern is None:
+        escaped = re.escape(prefix)
+        pattern = _SI_PATTERNS[prefix] = re.compile(rb'<' + escaped + rb'si\b[^>]*?(?:/>|>.*?</' + escaped + rb'si>)',
+                                                    re.S)
+    return pattern
+
+def parse_items(xml_bytes):
+    # Devuelve (lista de <si> sin prefijo, count declarado o None). Si hay <si> que no se pudieron leer (p. ej. con
+    # un prefijo distinto al de la raiz) levanta ValueError: una tabla vacia por error haria que las celdas t="s"
+    # apunten a los textos de otro libro
+    root = _SST_ROOT.search(xml_bytes)
+    prefix = root.group(1) or b'' if root else b''
+    items = _si_pattern(prefix).findall(xml_bytes)
+    if prefix:
+        strip = re.compile(rb'<(/?)' + re.escape(prefix))
+        items = [strip.sub(rb'<\1', si) for si in items]
+    total = len(_ANY_SI.findall(xml_bytes))
+    if len(items) != total:
+        raise ValueError(f"sharedStrings has {total} <si> entries but only {len(items)} could be read")
+    match = _SST_COUNT.search(root.group(0)) if root else None
+    return items, int(match.group(1)) if match else None
+
+# Memoria por entrada ademas de sus bytes (objeto bytes, lugar en la lista y en el dict), medida con tracemalloc
+_ITEM_OVERHEAD = 120
+
+class SharedStringsTable:
+    # Tabla de sharedStrings del destino con un dict <si> -> indice para deduplicar en O(1)
+    def __init__(self, xml_bytes=None):
+        self.items = []
+        self.index = {}
+        self.count = 0
+        self.modified = False
+        if xml_bytes:
+            items, count = parse_items(xml_bytes)
+            for si in items:
+                self.index.setdefault(si, len(self.items))
+                self.items.append(si)
+            self.count = count if count is not None else len(self.items)
+
+    def __deepcopy__(self, memo):
+        # Los <si> son bytes inmutables: alcanza con copiar la lista y el dict (PreparedTemplate copia la tabla por merge)
+        table = SharedStringsTable()
+        table.items = list(self.items)
+        table.index = dict(self.index)
+        table.count = self.count
+        table.modified = self.modified
+        return table
+
+    def estimated_size(self):
+        # Memoria aproximada que retiene la tabla (ver PreparedTemplate.size)
+        return sum(len(si) for si in self.items) + len(self.items) * _ITEM_OVERHEAD
+
+    def add(self, si):
+        position = self.index.get(si)
+        if position is None:
+            position = self.index[si] = len(self.items)
+            self.items.append(si)
+            self.modified = True
+        return position
+
+    def merge_from(self, xml_bytes):
+        # Devuelve el mapa indice origen -> indice destino, o None si coincide con la identidad
+        items, count = parse_items(xml_bytes)
+        mapping = [self.add(si) for si in items]
+        # count es orientativo: solo se reescribe la tabla si add() agrego alguna entrada nueva
+        self.count += count if count is not None else len(mapping)
+        # Una tabla sin entradas no vuelve None: si alguna celda t="s" la referencia, el remapeo falla en vez de
+        # dejarla apuntando a los textos del libro base
+        if mapping and all(old == new for old, new in enumerate(mapping)):
+            return None
+        return mapping
+
+    def to_bytes(self):
+        header = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  f'<sst xmlns="{NS_MAIN}" count="{max(self.count, len(self.items))}" uniqueCount="{len(self.items)}">')
+        return header.encode('utf-8') + b''.join(self.items) + b'</sst>'
+
+def shared_string_callback(mapping):
+    # Callback de texto para <v> en SheetRewriter: solo se tocan las celdas t="s"
+    def remap(text, cell_attrs):
+        if cell_attrs.get('t') == 's' and text:
+            index = int(text)
+            if index >= len(mapping):
+                raise ValueError(f"Cell references shared string {index}, but the source table has {len(mapping)}")
+            return str(mapping[index])
+        return text
+    return remap
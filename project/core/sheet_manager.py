@@ -1,21 +1,33 @@
 import shutil
 import os
-from core.xml_utils import parse_xml, write_xml, generate_unique_id
+import xml.etree.ElementTree as ET
+from core.xml_utils import parse_xml, parse_xml_shared, write_xml, IdAllocator, NS_MAIN
 
 class SheetManager:
-    def __init__(self, sheets_dir, workbook_path):
+    def __init__(self, sheets_dir, workbook_path, id_allocator=None):
         self.sheets_dir = sheets_dir
         self.workbook_path = workbook_path
+        self.id_allocator = id_allocator  # r:id compartidos con el RelsManager de workbook.xml.rels
+        self.sheet_ids = None
 
     def list_sheets(self):
-        _, root = parse_xml(self.workbook_path)
+        with open(self.workbook_path, 'rb') as f:
+            _, root = parse_xml_shared(f.read())
         sheets = root.find('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheets')
         return [sheet.attrib['name'] for sheet in sheets.findall('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet')]
 
     def add_sheet_entry(self, sheet_id, r_id, name):
         tree, root = parse_xml(self.workbook_path)
         sheets = root.find('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheets')
-        sheet = ET.Element('sheet', name=name, sheetId=str(sheet_id), attrib={'{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id': r_id})
+        if self.sheet_ids is None:
+            self.sheet_ids = IdAllocator((sheet.attrib['sheetId'] for sheet in sheets), prefix='')
+        if sheet_id is None:
+            sheet_id = self.sheet_ids.new_id()
+        else:
+            self.sheet_ids.reserve(str(sheet_id))
+        if r_id is None:
+            r_id = self.id_allocator.new_id()
+        sheet = ET.Element(f'{{{NS_MAIN}}}sheet', name=name, sheetId=str(sheet_id), attrib={'{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id': r_id})
         sheets.append(sheet)
         write_xml(tree, self.workbook_path)
 
@@ -0,0 +1,229 @@
+import html
+import re
+from array import array
+from core.zip_handler import ZipHandler
+from core.rels_manager import RelsIndex, resolve_target
+from core.shared_strings import REL_SHARED_STRINGS
+from core.xml_utils import parse_xml_shared, NS_MAIN, NS_REL
+
+# Lectura de celdas en streaming sin openpyxl: la hoja se descomprime de a chunks y las filas y celdas se sacan con
+# regex sobre los bytes. Con columns=... la regex de celdas solo coincide con esas columnas, asi que las demas se
+# saltean dentro del motor de regex sin crear ningun objeto de Python.
+# Los valores salen tipados: int/float para numeros, str, bool y None para celdas vacias; las fechas quedan como el
+# numero de serie de Excel (el formato vive en styles.xml). Para filtrar columnas las celdas tienen que traer r=
+# (Excel y los writers habituales siempre lo escriben); sin columns se toleran celdas sin r= contando posiciones
+
+_ROOT_PREFIX = re.compile(rb'<([\w.-]+:)?worksheet\b')
+_SST_ROOT_PREFIX = re.compile(rb'<([\w.-]+:)?sst\b')
+_CELL_TYPE = re.compile(rb'\bt="(\w+)"')
+
+def column_index(letters):
+    # 'A' -> 0, 'AB' -> 27
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+def column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _text(raw):
+    text = raw.decode('utf-8')
+    return html.unescape(text) if '&' in text else text
+
+def _iter_blocks(chunks, close_tag):
+    # Agrupa los chunks en bloques que terminan en close_tag, asi ningun elemento queda partido entre dos bloques
+    tail = b''
+    for chunk in chunks:
+        data = tail + chunk
+        cut = data.rfind(close_tag)
+        if cut < 0:
+            tail = data
+            continue
+        cut += len(close_tag)
+        yield data[:cut]
+        tail = data[cut:]
+    if tail:
+        yield tail
+
+class SharedStringArray:
+    # sharedStrings compacto: todos los textos en un solo str y un array de offsets, en vez de un objeto str por
+    # entrada. Cada string se arma recien cuando se pide. Los runs de texto enriquecido se concatenan y el texto
+    # fonetico (<rPh>) se descarta, como hace Excel al mostrar la celda
+    def __init__(self, chunks=()):
+        pieces = []
+        self.offsets = array('Q', [0])
+        total = 0
+        # El prefijo sale del primer chunk, antes de cortar en bloques: con </si> sin prefijo una tabla <x:si> nunca
+        # encontraria el corte y se acumularia entera en memoria
+        chunks = iter(chunks)
+        first = next(chunks, b'')
+        match = _SST_ROOT_PREFIX.search(first)
+        raw_prefix = match.group(1) or b'' if match else b''
+        prefix = re.escape(raw_prefix)
+        si_pattern = re.compile(rb'<' + prefix + rb'si\b[^>]*?(?:/>|>(.*?)</' + prefix + rb'si>)', re.S)
+        t_pattern = re.compile(rb'<' + prefix + rb't\b[^>]*?(?:/>|>(.*?)</' + prefix + rb't>)', re.S)
+        phonetic = re.compile(rb'<' + prefix + rb'rPh\b.*?</' + prefix + rb'rPh>', re.S)
+        for block in _iter_blocks(_prepend(first, chunks), b'</' + raw_prefix + b'si>'):
+            for si in si_pattern.finditer(block):
+                inner = si.group(1) or b''
+                if b'rPh' in inner:
+                    inner = phonetic.sub(b'', inner)
+                text = _text(b''.join(t.group(1) or b'' for t in t_pattern.finditer(inner)))
+                pieces.append(text)
+                total += len(text)
+                self.offsets.append(total)
+        self.text = ''.join(pieces)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+class SheetReader:
+    def __init__(self, source):
+        # source: ZipHandler, bytes, mmap o ruta (que se mapea sin leerla al heap)
+        self.zip = source if isinstance(source, ZipHandler) else ZipHandler(source, lazy=True)
+        if not self.zip.files:
+            self.zip.extract()
+        _, root = parse_xml_shared(self.zip.get_file_content('xl/workbook.xml', cache=False))
+        rels = RelsIndex(self.zip.get_file_content('xl/_rels/workbook.xml.rels', cache=False))
+        self.sheets = {}  # nombre -> ruta de la hoja dentro del zip, en el orden del libro
+        for sheet in root.iter(f'{{{NS_MAIN}}}sheet'):
+            target = rels.target(sheet.attrib[f'{{{NS_REL}}}id'])
+            if target is not None:
+                self.sheets[sheet.attrib['name']] = resolve_target('xl/workbook.xml', target)
+        rel = rels.find_by_type(REL_SHARED_STRINGS)
+        self.shared_strings_path = resolve_target('xl/workbook.xml', rel[1]) if rel else None
+        self._shared_strings = None
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    @property
+    def shared_strings(self):
+        # Se carga la primera vez que aparece una celda t="s"
+        if self._shared_strings is None:
+            path = self.shared_strings_path
+            self._shared_strings = SharedStringArray(self.zip.iter_file_chunks(path) if path in self.zip.files else ())
+        return self._shared_strings
+
+    def close(self):
+        self.zip.close()
+
+    def iter_rows(self, sheet_name, columns=None):
+        # Genera una tupla por fila presente en la hoja (las filas vacias no estan en el XML y no se generan).
+        # columns: letras ('A', 'C') o indices desde 0, y cada tupla trae esas columnas en ese orden (None si la
+        # celda no existe). Sin columns, cada tupla va desde la columna A hasta la ultima celda de la fila
+        path = self.sheets.get(sheet_name)
+        if path is None:
+            raise KeyError(f"No sheet named {sheet_name!r}")
+        wanted = None
+        if columns is not None:
+            wanted = {}
+            for position, column in enumerate(columns):
+                letters = column_letter(column) if isinstance(column, int) else column.upper()
+                wanted.setdefault(letters.encode('ascii'), []).append(position)
+        width = len(columns) if columns is not None else 0
+        # El namespace main puede venir con prefijo (<x:worksheet>, <x:row>...): se detecta en el primer chunk
+        chunks = self.zip.iter_file_chunks(path)
+        first = next(chunks, b'')
+        match = _ROOT_PREFIX.search(first)
+        raw_prefix = match.group(1) or b'' if match else b''
+        prefix = re.escape(raw_prefix)
+        close_row = b'</' + raw_prefix + b'row>'
+        # Una sola regex por hoja recorre todo el bloque: cada </row> cierra una fila y entre medio solo coinciden las
+        # celdas que interesan. El contenido de la celda va "desenrollado" ([^<]* y < que no cierran) porque .*?
+        # avanza de a un caracter. Grupos: letras de la columna (r= primero, o r= despues de otros atributos),
+        # atributos y contenido; en un </row> todos son None
+        close_cell = rb'</' + prefix + rb'c>'
+        content = rb'(?:/>|>([^<]*(?:<(?!/' + prefix + rb'c>)[^<]*)*)' + close_cell + rb')'
+        # Sin columnas pedidas el grupo de la columna es opcional (celdas sin r=); con columnas, la celda tiene que
+        # coincidir con alguna de ellas
+        if wanted is None:
+            columns_re, optional = rb'[A-Z]+', b'?'
+        else:
+            columns_re, optional = b'|'.join(re.escape(letters) for letters in wanted), b''
+        cell_pattern = re.compile(re.escape(close_row) + rb'|<' + prefix + rb'c\b(?:\s+r="(' + columns_re + rb')\d+"|'
+                                  rb'(?!\s+r=)(?=[^>]*?\sr="(' + columns_re + rb')\d+"))' + optional +
+                                  rb'([^>]*?)' + content)
+        value_pattern = re.compile(rb'<' + prefix + rb'v\b[^>]*>([^<]*)</' + prefix + rb'v>')
+        t_pattern = re.compile(rb'<' + prefix + rb't\b[^>]*?(?:/>|>(.*?)</' + prefix + rb't>)', re.S)
+        shared_strings = None
+
+        open_v, close_v = b'<' + raw_prefix + b'v>', b'</' + raw_prefix + b'v>'
+
+        def convert(attrs, inner):
+            nonlocal shared_strings
+            if not inner:
+                return None
+            # <v> casi nunca trae atributos: find es bastante mas rapido que la regex, que queda para el resto
+            start = inner.find(open_v)
+            if start >= 0:
+                raw = inner[start + len(open_v):inner.find(close_v, start)]
+            else:
+                value = value_pattern.search(inner)
+                raw = value.group(1) if value else None
+            cell_type = _CELL_TYPE.search(attrs).group(1) if b't="' in attrs else b'n'
+            if cell_type == b'inlineStr':
+                return _text(b''.join(t.group(1) or b'' for t in t_pattern.finditer(inner)))
+            if raw is None:
+                return None
+            if cell_type == b'n':
+                try:
+                    return int(raw)
+                except ValueError:
+                    return float(raw)
+            if cell_type == b's':
+                if shared_strings is None:
+                    shared_strings = self.shared_strings
+                return shared_strings[int(raw)]
+            if cell_type == b'b':
+                return raw == b'1'
+            return _text(raw)  # str, e (errores como #N/A) y d (fechas ISO)
+
+        indexes = {}  # letras -> indice de columna, para no recalcularlo en cada fila
+        values = [None] * width
+        for block in _iter_blocks(_prepend(first, chunks), close_row):
+            for cell in cell_pattern.finditer(block):
+                attrs = cell.group(3)
+                if attrs is None:
+                    yield tuple(values)
+                    values = [None] * width
+                    continue
+                letters = cell.group(1) or cell.group(2)
+                value = convert(attrs, cell.group(4))
+                if wanted is not None:
+                    for position in wanted[letters]:
+                        values[position] = value
+                    continue
+                # Sin columnas pedidas: una celda sin r= va en la posicion siguiente a la anterior
+                if letters is None:
+                    index = len(values)
+                else:
+                    index = indexes.get(letters)
+                    if index is None:
+                        index = indexes[letters] = column_index(letters.decode('ascii'))
+                if index >= len(values):
+                    values.extend([None] * (index - len(values) + 1))
+                values[index] = value
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+def iter_rows(source, sheet_name, columns=None):
+    # Atajo para leer una sola hoja; para varias hojas del mismo libro conviene un SheetReader
+    reader = SheetReader(source)
+    try:
+        yield from reader.iter_rows(sheet_name, columns)
+    finally:
+        if reader.zip is not source:
+            reader.close()
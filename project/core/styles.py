@@ -0,0 +1,159 @@
+import copy
+import xml.etree.ElementTree as ET
+from core.xml_utils import parse_xml_bytes, parse_xml_shared, write_xml_to_bytes, IdAllocator, NS_MAIN
+
+REL_STYLES = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles'
+
+# Orden de los hijos de <styleSheet> segun el schema; se usa para insertar secciones que falten
+_SECTION_ORDER = ('numFmts', 'fonts', 'fills', 'borders', 'cellStyleXfs', 'cellXfs',
+                  'cellStyles', 'dxfs', 'tableStyles', 'colors', 'extLst')
+_FIRST_CUSTOM_NUMFMT = 164
+
+def canonical_key(element):
+    return (element.tag, tuple(sorted(element.attrib.items())), (element.text or '').strip(),
+            tuple(canonical_key(child) for child in element))
+
+class StylesTable:
+    # styles.xml del destino; fonts, fills, borders, numFmts, xfs y dxfs se deduplican por su clave canonica
+    def __init__(self, xml_bytes):
+        self.tree, self.root = parse_xml_bytes(xml_bytes)
+        self.modified = False
+        self.sections = {}  # nombre -> (elemento contenedor, {clave canonica: indice})
+        for name in ('fonts', 'fills', 'borders', 'cellStyleXfs', 'cellXfs', 'dxfs'):
+            container = self._section(name)
+            index = {}
+            for position, child in enumerate(container):
+                index.setdefault(canonical_key(child), position)
+            self.sections[name] = (container, index)
+        self.num_fmts = {}  # formatCode -> numFmtId
+        self.num_fmt_ids = IdAllocator([str(_FIRST_CUSTOM_NUMFMT - 1)], prefix='')
+        numfmts = self.root.find(f'{{{NS_MAIN}}}numFmts')
+        for num_fmt in (numfmts if numfmts is not None else ()):
+            self.num_fmts.setdefault(num_fmt.attrib['formatCode'], num_fmt.attrib['numFmtId'])
+            self.num_fmt_ids.reserve(num_fmt.attrib['numFmtId'])
+
+    def _section(self, name):
+        container = self.root.find(f'{{{NS_MAIN}}}{name}')
+        if container is None:
+            position = 0
+            for child in self.root:
+                tag = child.tag.rsplit('}', 1)[-1]
+                if tag in _SECTION_ORDER and _SECTION_ORDER.index(tag) < _SECTION_ORDER.index(name):
+                    position = list(self.root).index(child) + 1
+            container = ET.Element(f'{{{NS_MAIN}}}{name}')
+            self.root.insert(position, container)
+        return container
+
+    def _add(self, name, element):
+        container, index = self.sections[name]
+        key = canonical_key(element)
+        position = index.get(key)
+        if position is None:
+            position = index[key] = len(container)
+            container.append(copy.deepcopy(element))
+            self.modified = True
+        return position
+
+    def merge_from(self, xml_bytes):
+        # Devuelve {'cellXfs': mapa, 'dxfs': mapa} con los mapas origen -> destino que no son la identidad, o None si
+        # ninguno cambia. cellXfs es el indice de los s= de celdas, filas y columnas; dxfs el de los dxfId de formatos
+        # condicionales y tablas. Solo se lee: los xf se copian antes de remapearlos y _add guarda una deepcopy
+        _, src_root = parse_xml_shared(xml_bytes)
+
+        num_fmt_map = {}
+        src_numfmts = src_root.find(f'{{{NS_MAIN}}}numFmts')
+        for num_fmt in (src_numfmts if src_numfmts is not None else ()):
+            num_fmt_map[num_fmt.attrib['numFmtId']] = self._add_num_fmt(num_fmt)
+
+        maps = {}
+        for name in ('fonts', 'fills', 'borders'):
+            src_section = src_root.find(f'{{{NS_MAIN}}}{name}')
+            maps[name] = [self._add(name, child) for child in (src_section if src_section is not None else ())]
+
+        for name in ('cellStyleXfs', 'cellXfs'):
+            src_section = src_root.find(f'{{{NS_MAIN}}}{name}')
+            mapping = []
+            for xf in (src_section if src_section is not None else ()):
+                xf = copy.copy(xf)
+                xf.attrib = dict(xf.attrib)
+                if 'numFmtId' in xf.attrib:
+                    xf.attrib['numFmtId'] = num_fmt_map.get(xf.attrib['numFmtId'], xf.attrib['numFmtId'])
+                for attr, section in (('fontId', 'fonts'), ('fillId', 'fills'), ('borderId', 'borders')):
+                    if attr in xf.attrib:
+                        xf.attrib[attr] = str(maps[section][int(xf.attrib[attr])])
+                if name == 'cellXfs' and 'xfId' in xf.attrib and maps['cellStyleXfs']:
+                    xf.attrib['xfId'] = str(maps['cellStyleXfs'][int(xf.attrib['xfId'])])
+                mapping.append(self._add(name, xf))
+            maps[name] = mapping
+
+        # Los <dxf> traen su propio numFmt (con id y formatCode): el id se lleva al de la tabla del destino
+        maps['dxfs'] = []
+        src_dxfs = src_root.find(f'{{{NS_MAIN}}}dxfs')
+        for dxf in (src_dxfs if src_dxfs is not None else ()):
+            num_fmt = dxf.find(f'{{{NS_MAIN}}}numFmt')
+            if num_fmt is not None and 'formatCode' in num_fmt.attrib:
+                dxf = copy.copy(dxf)
+                dxf[list(dxf).index(num_fmt)] = ET.Element(num_fmt.tag, dict(num_fmt.attrib,
+                                                                             numFmtId=self._add_num_fmt(num_fmt)))
+            maps['dxfs'].append(self._add('dxfs', dxf))
+
+        style_map = {name: maps[name] for name in ('cellXfs', 'dxfs')
+                     if not all(old == new for old, new in enumerate(maps[name]))}
+        return style_map or None
+
+    def _add_num_fmt(self, num_fmt):
+        num_fmt_id, format_code = num_fmt.attrib['numFmtId'], num_fmt.attrib['formatCode']
+        if int(num_fmt_id) < _FIRST_CUSTOM_NUMFMT:
+            return num_fmt_id
+        if format_code not in self.num_fmts:
+            self.num_fmts[format_code] = self.num_fmt_ids.new_id()
+            ET.SubElement(self._section('numFmts'), f'{{{NS_MAIN}}}numFmt',
+                          numFmtId=self.num_fmts[format_code], formatCode=format_code)
+            self.modified = True
+        return self.num_fmts[format_code]
+
+    def to_bytes(self):
+        for name in ('numFmts', 'fonts', 'fills', 'borders', 'cellStyleXfs', 'cellXfs', 'dxfs'):
+            container = self.root.find(f'{{{NS_MAIN}}}{name}')
+            if container is not None:
+                container.attrib['count'] = str(len(container))
+        return write_xml_to_bytes(self.tree)
+
+def remap_dxf_ids(root, dxf_map):
+    # dxfId de una tabla (headerRowDxfId, dataDxfId, totalsRowDxfId... en <table> y en cada <tableColumn>)
+    for element in root.iter():
+        for attr, value in element.attrib.items():
+            if attr.endswith('DxfId'):
+                element.attrib[attr] = str(dxf_map[int(value)])
+
+def style_callbacks(style_map):
+    # Callbacks de atributos para SheetRewriter a partir de lo que devuelve StylesTable.merge_from: s= en <c> y <row>,
+    # style= en <col> y dxfId= en <cfRule>.
+    # Un <c> o <col> sin s=/style= usa el cellXfs[0] del origen, que puede no ser el 0 del destino: en ese caso se les
+    # agrega el atributo. Las celdas que no estan en el XML siguen tomando el estilo por defecto del libro base.
+    # <row> sin s= no lleva estilo (s= solo cuenta con customFormat="1"), asi que ahi no se agrega
+    def remap(mapping, attr, implicit=None):
+        def callback(attrs):
+            value = attrs.get(attr)
+            if value is None:
+                if implicit is None:
+                    return False
+                attrs[attr] = implicit
+                return True
+            new = str(mapping[int(value)])
+            if new != value:
+                attrs[attr] = new
+                return True
+            return False
+        return callback
+
+    callbacks = {}
+    xf_map = style_map.get('cellXfs')
+    if xf_map is not None:
+        implicit = str(xf_map[0]) if xf_map and xf_map[0] != 0 else None
+        callbacks.update({'c': remap(xf_map, 's', implicit), 'row': remap(xf_map, 's'),
+                          'col': remap(xf_map, 'style', implicit)})
+    dxf_map = style_map.get('dxfs')
+    if dxf_map is not None:
+        callbacks['cfRule'] = remap(dxf_map, 'dxfId')
+    return callbacks
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from core.xlsx_merger import PreparedTemplate
+
+# Cache LRU de PreparedTemplate para un servicio que combina siempre contra los mismos libros base.
+# La clave es el SHA-256 del contenido, asi que dos rutas al mismo archivo (o los mismos bytes subidos otra vez)
+# comparten template, y un archivo modificado en el lugar genera uno nuevo. Por lo mismo las rutas se leen a bytes
+# en vez de mapearse: un template guardado no puede cambiar si alguien reescribe el archivo
+
+def content_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+class TemplateCache:
+    def __init__(self, max_bytes=256 << 20, max_entries=None):
+        # max_bytes acota la suma de PreparedTemplate.size; un template mas grande que el limite se arma igual pero no
+        # se guarda. Los desalojados no se cierran: un merge en curso puede seguir leyendo sus miembros, y la memoria
+        # se libera cuando se suelta la ultima referencia
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.templates = OrderedDict()  # clave -> PreparedTemplate, del menos al mas usado
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._building = {}  # clave -> lock del hilo que esta armando ese template
+
+    def get(self, source):
+        # Devuelve el PreparedTemplate de source (bytes, ruta o un PreparedTemplate, que pasa tal cual).
+        # Si varios hilos piden a la vez un template que no esta, lo arma el primero y el resto lo espera
+        if isinstance(source, PreparedTemplate):
+            return source
+        if isinstance(source, (str, os.PathLike)):
+            source = Path(source).read_bytes()
+        key = content_key(source)
+        with self._lock:
+            template = self._lookup(key)
+            if template is not None:
+                return template
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                template = self._lookup(key)
+                if template is not None:
+                    return template
+                self.misses += 1
+            try:
+                template = PreparedTemplate(source)
+            except BaseException:
+                with self._lock:
+                    self._building.pop(key, None)
+                raise
+            with self._lock:
+                self._building.pop(key, None)
+                if template.size <= self.max_bytes:
+                    self.templates[key] = template
+                    self.size += template.size
+                    self._evict()
+        return template
+
+    def _lookup(self, key):
+        template = self.templates.get(key)
+        if template is not None:
+            self.templates.move_to_end(key)
+            self.hits += 1
+        return template
+
+    def _evict(self):
+        while self.templates and (self.size > self.max_bytes or
+                                  self.max_entries is not None and len(self.templates) > self.max_entries):
+            _, template = self.templates.popitem(last=False)
+            self.size -= template.size
+
+    def clear(self):
+        with self._lock:
+            self.templates.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'templates': len(self.templates), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
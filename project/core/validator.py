@@ -0,0 +1,203 @@
+import os
+import posixpath
+import re
+import time
+import zlib
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote
+import xml.etree.ElementTree as ET
+from core.zip_handler import ZipHandler
+from core.content_types import ContentTypes
+from core.rels_manager import resolve_target, rels_path_for
+from core.xml_utils import parse_xml_shared, NS_REL, NS_PKG_REL
+
+# Validacion del paquete en memoria, sin extraer a disco: content types, .rels, destinos colgados y r:id sin
+# relacion. Pensada para correr despues de cada merge, asi que las partes XML no se parsean: los r:id se buscan
+# con regex sobre los bytes descomprimidos en chunks (y de paso se verifica el CRC de cada parte)
+
+CONTENT_TYPES_PATH = '[Content_Types].xml'
+
+_REL_PREFIX = re.compile(rb'xmlns:([\w.-]+)\s*=\s*["\']' + re.escape(NS_REL.encode()) + rb'["\']')
+
+class ValidationIssue:
+    __slots__ = ('code', 'part', 'message')
+
+    def __init__(self, code, part, message):
+        self.code = code  # p. ej. 'dangling_target', 'missing_rel_id' (ver validate_package)
+        self.part = part  # parte donde esta el problema ('' para el paquete)
+        self.message = message
+
+    def __repr__(self):
+        return f"ValidationIssue({self.code!r}, {self.part!r}, {self.message!r})"
+
+    def to_dict(self):
+        return {'code': self.code, 'part': self.part, 'message': self.message}
+
+class ValidationResult:
+    def __init__(self):
+        self.issues = []
+        self.parts = 0
+        self.relationships = 0
+
+    @property
+    def ok(self):
+        return not self.issues
+
+    def add(self, code, part, message):
+        self.issues.append(ValidationIssue(code, part, message))
+
+    def to_dict(self):
+        return {'ok': self.ok, 'parts': self.parts, 'relationships': self.relationships,
+                'issues': [issue.to_dict() for issue in self.issues]}
+
+def source_part_for(rels_path):
+    # 'xl/_rels/workbook.xml.rels' -> 'xl/workbook.xml'; '_rels/.rels' -> '' (el paquete)
+    folder, name = posixpath.split(rels_path)
+    return posixpath.join(posixpath.dirname(folder), name[:-len('.rels')])
+
+def _is_rels(path):
+    return path.endswith('.rels') and posixpath.basename(posixpath.dirname(path)) == '_rels'
+
+def build_part_graph(zip_handler, result):
+    # Dict: parte origen -> {r:id: (tipo, parte destino o None si es externa)}; los problemas de cada .rels van a result
+    graph = {}
+    for path in zip_handler.files:
+        if not _is_rels(path):
+            continue
+        source = source_part_for(path)
+        if source and source not in zip_handler.files:
+            result.add('orphan_rels', path, f"{path} belongs to {source}, which is not in the package")
+        try:
+            _, root = parse_xml_shared(zip_handler.get_file_content(path, cache=False))
+        except ET.ParseError as e:
+            result.add('bad_xml', path, f"{path} is not well-formed: {e}")
+            continue
+        relationships = graph[source] = {}
+        for rel in root.iter(f'{{{NS_PKG_REL}}}Relationship'):
+            r_id, target = rel.attrib.get('Id'), rel.attrib.get('Target')
+            if r_id is None or target is None:
+                result.add('bad_relationship', path, f"{path} has a Relationship without Id or Target")
+                continue
+            if r_id in relationships:
+                result.add('duplicate_rel_id', path, f"{path} defines {r_id} more than once")
+            result.relationships += 1
+            if rel.attrib.get('TargetMode') == 'External':
+                relationships[r_id] = (rel.attrib.get('Type'), None)
+                continue
+            target_path = resolve_target(source, target.split('#', 1)[0])
+            if target_path not in zip_handler.files and unquote(target_path) in zip_handler.files:
+                target_path = unquote(target_path)
+            relationships[r_id] = (rel.attrib.get('Type'), target_path)
+            if target_path not in zip_handler.files:
+                result.add('dangling_target', path, f"{r_id} in {path} points to {target_path}, which does not exist")
+    return graph
+
+def referenced_ids(chunks):
+    # r:id, r:embed, r:link... de una parte XML. El prefijo de NS_REL sale de los xmlns: que van apareciendo;
+    # cada chunk se corta en el ultimo '>' para que ningun atributo quede partido entre dos chunks.
+    # Un patron por prefijo que empieza con el literal 'r:' busca ~10x mas rapido que uno que empiece con \s,
+    # asi que el espacio antes del atributo se verifica aparte
+    ids = set()
+    patterns = {}
+    tail = b''
+    for chunk in chunks:
+        data = tail + chunk
+        cut = data.rfind(b'>') + 1
+        data, tail = data[:cut], data[cut:]
+        for prefix in _REL_PREFIX.findall(data):
+            if prefix not in patterns:
+                patterns[prefix] = re.compile(re.escape(prefix) + rb':[\w.-]+\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+        for pattern in patterns.values():
+            for match in pattern.finditer(data):
+                if data[match.start() - 1:match.start()].isspace():
+                    ids.add((match.group(1) or match.group(2) or '').decode('utf-8'))
+    return ids
+
+def validate_package(source, check_references=True, stop_on_error=False):
+    # source: ZipHandler, bytes, mmap o ruta (que se mapea sin leerla al heap). Devuelve un ValidationResult.
+    # Codigos: missing_part, bad_xml, missing_content_type, dangling_override, orphan_rels, bad_relationship,
+    # duplicate_rel_id, dangling_target, missing_rel_id y corrupt_part.
+    # Con check_references=False no se descomprimen las partes XML y solo se revisan content types y .rels.
+    # Con stop_on_error=True se corta en la primera etapa que encuentre algun problema, sin leer el resto de las partes.
+    # Ojo: si source es un ZipHandler con streams pendientes (un merge sin escribir), revisarlo los ejecuta
+    zip_handler = source if isinstance(source, ZipHandler) else ZipHandler(source, lazy=True)
+    try:
+        if zip_handler.central_dir_offset is None and not zip_handler.files:
+            zip_handler.extract()
+        return _validate(zip_handler, check_references, stop_on_error)
+    finally:
+        if zip_handler is not source:
+            zip_handler.close()
+
+def _validate(zip_handler, check_references, stop_on_error):
+    result = ValidationResult()
+    files = zip_handler.files
+    result.parts = len(files)
+    for required in (CONTENT_TYPES_PATH, '_rels/.rels'):
+        if required not in files:
+            result.add('missing_part', '', f"The package has no {required}")
+
+    content_types = None
+    if CONTENT_TYPES_PATH in files:
+        try:
+            content_types = ContentTypes(zip_handler.get_file_content(CONTENT_TYPES_PATH, cache=False))
+        except ET.ParseError as e:
+            result.add('bad_xml', CONTENT_TYPES_PATH, f"{CONTENT_TYPES_PATH} is not well-formed: {e}")
+    if content_types is not None:
+        for path in files:
+            if path != CONTENT_TYPES_PATH and not path.endswith('/') and content_types.get(path) is None:
+                result.add('missing_content_type', path, f"{path} has no Default or Override content type")
+        for part_name in content_types.overrides:
+            if part_name.lstrip('/') not in files:
+                result.add('dangling_override', part_name, f"Override for {part_name}, which does not exist")
+
+    if stop_on_error and result.issues:
+        return result
+
+    graph = build_part_graph(zip_handler, result)
+    if not check_references or stop_on_error and result.issues:
+        return result
+    for path in files:
+        if stop_on_error and result.issues:
+            break
+        if not path.endswith('.xml') or path == CONTENT_TYPES_PATH:
+            continue
+        try:
+            ids = referenced_ids(zip_handler.iter_file_chunks(path))
+        except (zipfile.BadZipFile, zlib.error) as e:
+            result.add('corrupt_part', path, f"{path} cannot be read: {e}")
+            continue
+        relationships = graph.get(path, {})
+        for r_id in sorted(ids - relationships.keys()):
+            where = 'its .rels' if rels_path_for(path) in files else 'a .rels file, which is missing'
+            result.add('missing_rel_id', path, f"{path} references {r_id}, but it is not in {where}")
+    return result
+
+def _validate_file(path, check_references, stop_on_error):
+    start = time.perf_counter()
+    try:
+        result = validate_package(path, check_references, stop_on_error)
+        issues = [issue.to_dict() for issue in result.issues]
+    except (zipfile.BadZipFile, OSError, ValueError) as e:
+        issues = [ValidationIssue('unreadable', '', f"{type(e).__name__}: {e}").to_dict()]
+    return {'path': str(path), 'ok': not issues, 'seconds': round(time.perf_counter() - start, 4), 'issues': issues}
+
+def validate_directory(root, pattern='*.xlsx', workers=None, check_references=True, stop_on_error=True):
+    # Valida en un pool de procesos todos los paquetes de root (recursivo) que coincidan con pattern.
+    # Por defecto cada paquete se deja de leer en la primera etapa con errores. Devuelve el resumen listo para json.dump
+    start = time.perf_counter()
+    paths = sorted(str(path) for path in Path(root).rglob(pattern) if path.is_file())
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(min(workers, len(paths))) as pool:
+            # Miles de libros chicos: de a varios por tarea para no pagar un viaje al proceso por archivo
+            chunksize = max(1, len(paths) // (workers * 8))
+            results = list(pool.map(_validate_file, paths, [check_references] * len(paths),
+                                    [stop_on_error] * len(paths), chunksize=chunksize))
+    else:
+        results = [_validate_file(path, check_references, stop_on_error) for path in paths]
+    invalid = sum(1 for result in results if not result['ok'])
+    return {'root': str(root), 'files': len(results), 'valid': len(results) - invalid, 'invalid': invalid,
+            'seconds': round(time.perf_counter() - start, 4), 'results': results}
@@ -1,71 +1,287 @@
-from core.zip_handler import ZipHandler
-from core.xml_utils import parse_xml_bytes, write_xml_to_bytes, generate_unique_id
+import copy
+from core.zip_handler import ZipHandler, ZipMember
+from core.content_types import ContentTypes
+from core.parts_manager import PartsManager
+from core.rels_manager import RelsIndex, resolve_target, relative_target
+from core.shared_strings import SharedStringsTable, shared_string_callback, REL_SHARED_STRINGS, CT_SHARED_STRINGS
+from core.styles import StylesTable, style_callbacks, REL_STYLES
+from core.formulas import formula_callback
+from core.metrics import phase
+from core.xml_utils import (parse_xml_bytes, parse_xml_shared, write_xml_to_bytes, xml_cache, IdAllocator, SheetRewriter,
+                            NS_MAIN, NS_REL)
 import xml.etree.ElementTree as ET
 
+CT_CHART = 'application/vnd.openxmlformats-officedocument.drawingml.chart+xml'
+
+# Lo que load_workbook deja armado del libro base; PreparedTemplate lo guarda y cada merge recibe una copia
+_TEMPLATE_STATE = ('id_allocator', 'workbook_tree', 'sheets_out', 'rels', 'content_types', 'sheet_names',
+                   'existing_names', 'sheet_ids', 'shared_strings_path', 'shared_strings', 'styles_path', 'styles')
+
+def build_sheet_rewriter(string_map=None, style_map=None, sheet_renames=None):
+    attr_callbacks = style_callbacks(style_map) if style_map is not None else {}
+    text_callbacks = {}
+    if string_map is not None:
+        text_callbacks['v'] = shared_string_callback(string_map)
+    if sheet_renames:
+        text_callbacks['f'] = formula_callback(sheet_renames)
+    return SheetRewriter(attr_callbacks, text_callbacks)
+
+class SheetRewriteJob:
+    # Reescritura diferida de una parte del origen. Guarda solo el miembro y los mapas (no el zip de origen),
+    # asi se puede mandar a un pool de procesos cuando el merger corre con workers=N
+    def __init__(self, source, string_map=None, style_map=None, sheet_renames=None):
+        self.source = source  # ZipMember o bytes
+        self.string_map = string_map
+        self.style_map = style_map
+        self.sheet_renames = sheet_renames
+
+    @property
+    def size_hint(self):
+        # La hoja reescrita pesa practicamente lo mismo que la original
+        return self.source.info.file_size if isinstance(self.source, ZipMember) else len(self.source)
+
+    def __call__(self):
+        chunks = self.source.iter_chunks() if isinstance(self.source, ZipMember) else (self.source,)
+        return build_sheet_rewriter(self.string_map, self.style_map, self.sheet_renames).rewrite(chunks)
+
+class PreparedTemplate:
+    # Libro base indexado y con workbook.xml, rels, content types, sharedStrings y styles ya parseados, para usarlo
+    # como primer origen de muchos merges (ver core.template_cache). Cada merge trabaja sobre una copia del estado
+    # parseado y comparte los miembros comprimidos, asi que el template tiene que seguir vivo hasta escribir la salida
+    def __init__(self, source):
+        merger = XLSXMerger(source)
+        merger.zip_a.extract()
+        merger.output_zip.files = dict(merger.zip_a.files)
+        merger.output_zip.members = dict(merger.zip_a.members)
+        merger.load_workbook()
+        self.zip = merger.zip_a
+        self.files = merger.output_zip.files  # incluye las partes que load_workbook ya descomprimio
+        self.members = merger.output_zip.members
+        self.state = {name: getattr(merger, name) for name in _TEMPLATE_STATE}
+        # Lo que ocupa en memoria: el zip comprimido (salvo que sea un mmap), las partes descomprimidas, los arboles
+        # parseados (estimados como en xml_cache) y las entradas de sharedStrings
+        self.size = sum(len(data) for data in self.files.values() if data is not None)
+        if self.zip.path is None:
+            self.size += len(self.zip.file_bytes)
+        parsed = ('xl/workbook.xml', 'xl/_rels/workbook.xml.rels', '[Content_Types].xml', merger.styles_path)
+        self.size += xml_cache.tree_factor * sum(len(self.files[path]) for path in parsed if self.files.get(path))
+        self.size += merger.shared_strings.estimated_size()
+
+    def apply(self, merger):
+        # Deja al merger como si hubiera extraido y cargado el libro base; deepcopy con un solo memo mantiene
+        # compartidos el IdAllocator de los rels y sheets_out dentro de workbook_tree
+        merger.output_zip.files = dict(self.files)
+        merger.output_zip.members = dict(self.members)
+        for name, value in copy.deepcopy(self.state).items():
+            setattr(merger, name, value)
+        merger.parts = PartsManager(merger.output_zip, merger.content_types)
+
 class XLSXMerger:
-    def __init__(self, file_a_bytes, file_b_bytes):
-        self.zip_a = ZipHandler(file_a_bytes)
-        self.zip_b = ZipHandler(file_b_bytes)
-        self.output_zip = ZipHandler()
+    def __init__(self, file_a_bytes, file_b_bytes=None, workers=None, processes=True, compression_levels=None,
+                 metrics=None):
+        # workers=N reparte la reescritura y compresion de las partes en un pool (de procesos, o de hilos con
+        # processes=False); las partes salen con el mismo contenido y en el mismo orden que sin workers.
+        # compression_levels se pasa al ZipHandler de salida (ver FAST_COMPRESSION_LEVELS).
+        # metrics es un sink de core.metrics (p. ej. MergeMetrics()) que recibe cada fase del merge.
+        # Los origenes (aca y en merge_many/build) pueden ser bytes, un mmap o rutas, que se mapean sin leerlas al heap.
+        # file_a_bytes tambien puede ser un PreparedTemplate: el libro base ya viene extraido y parseado
+        self.metrics = metrics
+        self.template = file_a_bytes if isinstance(file_a_bytes, PreparedTemplate) else None
+        self.zip_a = self.template.zip if self.template else ZipHandler(file_a_bytes, lazy=True, metrics=metrics)
+        self.zip_b = ZipHandler(file_b_bytes, lazy=True, metrics=metrics) if file_b_bytes is not None else None
+        self.output_zip = ZipHandler(compression_levels=compression_levels, metrics=metrics)
+        self.id_allocator = IdAllocator()
+        self.workers = workers
+        self.processes = processes
+
+    @classmethod
+    def merge_many(cls, sources, output=None, workers=None, processes=True, compression_levels=None, metrics=None):
+        # El primer origen es la base; el resto se extrae de a uno a medida que se consume el iterable
+        sources = iter(sources)
+        try:
+            base = next(sources)
+        except StopIteration:
+            raise ValueError("merge_many needs at least one source") from None
+        merger = cls(base, workers=workers, processes=processes, compression_levels=compression_levels,
+                     metrics=metrics)
+        if output is not None:
+            return merger.merge_to(output, sources)
+        return merger.merge(sources)
+
+    @classmethod
+    def append_many(cls, path, sources, workers=None, processes=True, compression_levels=None, metrics=None):
+        # Agrega las hojas de sources al .xlsx de path sin reescribirlo: ver append()
+        merger = cls(path, workers=workers, processes=processes, compression_levels=compression_levels,
+                     metrics=metrics)
+        try:
+            merger.append(sources)
+        finally:
+            merger.zip_a.close()
+
+    def merge(self, sources=None):
+        self.build(sources)
+        return self.output_zip.create_zip_bytes(self.workers, self.processes)
+
+    def merge_to(self, output, sources=None):
+        # Igual que merge() pero escribe el resultado directo en una ruta o stream, sin armarlo en memoria
+        self.build(sources)
+        self.output_zip.write_to(output, self.workers, self.processes)
 
-    def merge(self):
-        self.zip_a.extract()
-        self.zip_b.extract()
+    def append(self, sources=None):
+        # Modo incremental: el libro base (que tiene que venir de una ruta) se modifica en el lugar. Solo se escriben
+        # las partes nuevas y las que cambian (workbook.xml y sus rels, [Content_Types].xml, docProps, y
+        # sharedStrings/styles si el origen agrega entradas), asi el costo depende de lo agregado y no del libro base
+        self.build(sources)
+        self.output_zip.append_to(self.zip_a, self.workers, self.processes)
 
-        self.output_zip.files = dict(self.zip_a.files)
+    def build(self, sources=None):
+        if sources is None:
+            sources = [self.zip_b] if self.zip_b is not None else []
 
-        self.merge_sheets()
+        if self.template is not None:
+            with phase(self.metrics, 'load_workbook'):
+                self.template.apply(self)
+        else:
+            self.zip_a.extract()
+
+            self.output_zip.files = dict(self.zip_a.files)
+            self.output_zip.members = dict(self.zip_a.members)
+
+            with phase(self.metrics, 'load_workbook'):
+                self.load_workbook()
+        for source in sources:
+            zip_src = source if isinstance(source, ZipHandler) else ZipHandler(source, lazy=True, metrics=self.metrics)
+            zip_src.extract()
+            with phase(self.metrics, 'merge_sheets', bytes_in=len(zip_src.file_bytes)) as measured:
+                copied = self.merge_sheets(zip_src)
+                if measured:
+                    measured.parts = copied
+        with phase(self.metrics, 'save_workbook'):
+            self.save_workbook()
         # self.ensure_docProps()
-        self.update_app_xml()
-        self.update_core_xml()
+        with phase(self.metrics, 'update_app_xml'):
+            self.update_app_xml()
+        with phase(self.metrics, 'update_core_xml'):
+            self.update_core_xml()
         self.ensure_content_types_and_rels()
 
-        return self.output_zip.create_zip_bytes()
+    def load_workbook(self):
+        # workbook.xml, sus rels y [Content_Types].xml se parsean una sola vez para todos los origenes
+        self.workbook_tree, root_out = parse_xml_bytes(self.output_zip.get_file_content('xl/workbook.xml'))
+        self.sheets_out = root_out.find(f'{{{NS_MAIN}}}sheets')
+        self.rels = RelsIndex(self.output_zip.get_file_content('xl/_rels/workbook.xml.rels'), self.id_allocator)
+        self.content_types = ContentTypes(self.output_zip.get_file_content('[Content_Types].xml'))
+        self.content_types.add_default('rels', 'application/vnd.openxmlformats-package.relationships+xml')
+        self.content_types.add_default('xml', 'application/xml')
+
+        sheets = self.sheets_out.findall(f'{{{NS_MAIN}}}sheet')
+        self.sheet_names = [sheet.attrib['name'] for sheet in sheets]
+        self.existing_names = set(self.sheet_names)
+        self.sheet_ids = IdAllocator((sheet.attrib['sheetId'] for sheet in sheets), prefix='')
+        self.parts = PartsManager(self.output_zip, self.content_types)
 
-    def merge_sheets(self):
-        output_workbook = self.output_zip.get_file_content('xl/workbook.xml')
-        output_workbook_rels = self.output_zip.get_file_content('xl/_rels/workbook.xml.rels')
+        rel = self.rels.find_by_type(REL_SHARED_STRINGS)
+        self.shared_strings_path = resolve_target('xl/workbook.xml', rel[1]) if rel else None
+        self.shared_strings = SharedStringsTable(self.output_zip.get_file_content(self.shared_strings_path) if rel else None)
 
-        src_workbook = self.zip_b.get_file_content('xl/workbook.xml')
-        src_workbook_rels = self.zip_b.get_file_content('xl/_rels/workbook.xml.rels')
+        rel = self.rels.find_by_type(REL_STYLES)
+        self.styles_path = resolve_target('xl/workbook.xml', rel[1]) if rel else None
+        self.styles = StylesTable(self.output_zip.get_file_content(self.styles_path)) if rel else None
 
-        tree_out, root_out = parse_xml_bytes(output_workbook)
-        tree_src, root_src = parse_xml_bytes(src_workbook)
+    def save_workbook(self):
+        if self.shared_strings.modified:
+            if self.shared_strings_path is None:
+                self.shared_strings_path = 'xl/sharedStrings.xml'
+                self.rels.add(REL_SHARED_STRINGS, 'sharedStrings.xml')
+                self.content_types.add_override(self.shared_strings_path, CT_SHARED_STRINGS)
+            self.output_zip.set_file_content(self.shared_strings_path, self.shared_strings.to_bytes())
+        if self.styles is not None and self.styles.modified:
+            self.output_zip.set_file_content(self.styles_path, self.styles.to_bytes())
+        self.output_zip.set_file_content('xl/workbook.xml', write_xml_to_bytes(self.workbook_tree))
+        self.output_zip.set_file_content('xl/_rels/workbook.xml.rels', self.rels.to_bytes())
+        self.output_zip.set_file_content('[Content_Types].xml', self.content_types.to_bytes())
 
-        sheets_out = root_out.find('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheets')
-        sheets_src = root_src.find('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheets')
+    def merge_sheets(self, zip_src=None):
+        # Devuelve la cantidad de partes copiadas del origen (hojas y todo lo que cuelga de ellas)
+        zip_src = zip_src or self.zip_b
+        src_workbook = zip_src.get_file_content('xl/workbook.xml')
+        src_rels = RelsIndex(zip_src.get_file_content('xl/_rels/workbook.xml.rels'))
 
-        existing_names = {sheet.attrib['name'] for sheet in sheets_out.findall('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet')}
-        sheet_id = len(existing_names) + 1
+        src_ct = ContentTypes(zip_src.get_file_content('[Content_Types].xml'))
+        part_map = {}
+        string_map = self.merge_shared_strings(zip_src, src_rels)
+        style_map = self.merge_styles(zip_src, src_rels)
 
-        for sheet in sheets_src.findall('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet'):
+        _, root_src = parse_xml_shared(src_workbook)
+        sheets_src = root_src.find(f'{{{NS_MAIN}}}sheets')
+
+        # Primero se resuelven los nombres: las formulas pueden apuntar a hojas del origen que se procesan despues
+        src_sheets = sheets_src.findall(f'{{{NS_MAIN}}}sheet')
+        sheet_renames = {}
+        new_names = []
+        for sheet in src_sheets:
             original_name = sheet.attrib['name']
             new_name = original_name
-            while new_name in existing_names:
+            while new_name in self.existing_names:
                 new_name = f"{original_name}(1)"
                 original_name += "(1)"
-            existing_names.add(new_name)
+            self.existing_names.add(new_name)
+            self.sheet_names.append(new_name)
+            new_names.append(new_name)
+            if new_name != sheet.attrib['name']:
+                sheet_renames[sheet.attrib['name']] = new_name
 
-            new_sheet_filename = f"xl/worksheets/sheet{sheet_id}.xml"
-            old_rid = sheet.attrib['{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id']
+        for sheet, new_name in zip(src_sheets, new_names):
+            # El arbol del origen es el compartido de xml_cache: se modifica y se agrega una copia del <sheet>
+            sheet = copy.copy(sheet)
+            sheet.attrib = dict(sheet.attrib)
+            old_rid = sheet.attrib[f'{{{NS_REL}}}id']
+            rel_type, old_sheet_target, _ = src_rels.relationships[old_rid]
+            old_sheet_path = resolve_target('xl/workbook.xml', old_sheet_target)
+            new_sheet_path = self.parts.allocate_part_name(old_sheet_path)
 
-            # Copy the sheet XML
-            old_sheet_target = self.find_target_in_rels(self.zip_b.get_file_content('xl/_rels/workbook.xml.rels'), old_rid)
-            sheet_bytes = self.zip_b.get_file_content(f"xl/{old_sheet_target}")
-            self.output_zip.set_file_content(new_sheet_filename, sheet_bytes)
+            # Copy the sheet XML with its drawings, charts, media, comments and tables
+            self.parts.copy_part_graph(zip_src, src_ct, old_sheet_path, new_sheet_path, part_map,
+                                       style_map.get('dxfs') if style_map else None)
+            self.rewrite_sheet(zip_src, old_sheet_path, new_sheet_path, string_map, style_map, sheet_renames)
 
             # Create new rel ID
-            new_rid = generate_unique_id(self.get_existing_rids(output_workbook_rels))
-            self.append_to_rels(output_workbook_rels, new_rid, 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet', f"worksheets/sheet{sheet_id}.xml")
+            new_rid = self.rels.add(rel_type, relative_target('xl/workbook.xml', new_sheet_path))
 
             # Append sheet
             sheet.attrib['name'] = new_name
-            sheet.attrib['{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'] = new_rid
-            sheets_out.append(sheet)
-            sheet_id += 1
+            sheet.attrib['sheetId'] = self.sheet_ids.new_id()
+            sheet.attrib[f'{{{NS_REL}}}id'] = new_rid
+            self.sheets_out.append(sheet)
+
+        # Las series de los charts copiados tambien referencian hojas por nombre
+        if sheet_renames:
+            for src_path, dst_path in part_map.items():
+                if src_ct.get(src_path) == CT_CHART:
+                    self.rewrite_sheet(zip_src, src_path, dst_path, None, None, sheet_renames)
+        return len(part_map)
+
+    def merge_shared_strings(self, zip_src, src_rels):
+        rel = src_rels.find_by_type(REL_SHARED_STRINGS)
+        if rel is None:
+            return None
+        src_path = resolve_target('xl/workbook.xml', rel[1])
+        return self.shared_strings.merge_from(zip_src.get_file_content(src_path, cache=False))
 
-        self.output_zip.set_file_content('xl/workbook.xml', write_xml_to_bytes(tree_out))
-        self.output_zip.set_file_content('xl/_rels/workbook.xml.rels', output_workbook_rels)
+    def merge_styles(self, zip_src, src_rels):
+        rel = src_rels.find_by_type(REL_STYLES)
+        if rel is None or self.styles is None:
+            return None
+        src_path = resolve_target('xl/workbook.xml', rel[1])
+        return self.styles.merge_from(zip_src.get_file_content(src_path, cache=False))
+
+    def rewrite_sheet(self, zip_src, src_path, dst_path, string_map, style_map=None, sheet_renames=None):
+        # Los t="s" y s= apuntan a las tablas del origen; la hoja se reescribe solo si algun mapa no es la identidad.
+        # La reescritura corre en streaming recien al escribir el zip de salida
+        if string_map is None and style_map is None and not sheet_renames:
+            return
+        source = zip_src.members.get(src_path) or zip_src.get_file_content(src_path, cache=False)
+        self.output_zip.set_file_stream(dst_path, SheetRewriteJob(source, string_map, style_map, sheet_renames))
 
     def ensure_docProps(self):
         if "docProps/app.xml" not in self.output_zip.files:
@@ -96,28 +312,11 @@ class XLSXMerger:
             self.output_zip.set_file_content("_rels/.rels", b'''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
 <Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"></Relationships>''')
 
-    def find_target_in_rels(self, rels_bytes, r_id):
-        tree, root = parse_xml_bytes(rels_bytes)
-        for rel in root.findall('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'):
-            if rel.attrib['Id'] == r_id:
-                return rel.attrib['Target']
-        return None
-
-    def get_existing_rids(self, rels_bytes):
-        tree, root = parse_xml_bytes(rels_bytes)
-        return {rel.attrib['Id'] for rel in root.findall('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship')}
-
-    def append_to_rels(self, rels_bytes, new_id, type_, target):
-        tree, root = parse_xml_bytes(rels_bytes)
-        ET.SubElement(root, 'Relationship', Id=new_id, Type=type_, Target=target)
-        self.output_zip.set_file_content('xl/_rels/workbook.xml.rels', write_xml_to_bytes(tree))
-
-
     def update_app_xml(self):
-        sheet_names = [x for x in self.output_zip.files if 'xl/worksheets/' in x]
+        sheet_names = self.sheet_names
+        # xmlns:vt lo declara ET al usar el prefijo registrado en xml_utils
         root = ET.Element('Properties', {
-            'xmlns': "http://schemas.openxmlformats.org/officeDocument/2006/extended-properties",
-            'xmlns:vt': "http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes"
+            'xmlns': "http://schemas.openxmlformats.org/officeDocument/2006/extended-properties"
         })
         ET.SubElement(root, 'Template').text = ''
         ET.SubElement(root, 'Application').text = 'Microsoft Excel'
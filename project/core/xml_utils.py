@@ -1,17 +1,285 @@
 import xml.etree.ElementTree as ET
+import copy
+import hashlib
 import io
+import re
+import threading
+from collections import OrderedDict
+from xml.parsers import expat
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+NS_CT = 'http://schemas.openxmlformats.org/package/2006/content-types'
+
+# Prefijos que usa Excel; si ET los renombra a ns0, ns1... los mc:Ignorable dejan de resolver
+ET.register_namespace('', NS_MAIN)
+for _prefix, _uri in {
+    'r': NS_REL,
+    'mc': 'http://schemas.openxmlformats.org/markup-compatibility/2006',
+    'x14ac': 'http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac',
+    'x14': 'http://schemas.microsoft.com/office/spreadsheetml/2009/9/main',
+    'x15': 'http://schemas.microsoft.com/office/spreadsheetml/2010/11/main',
+    'x15ac': 'http://schemas.microsoft.com/office/spreadsheetml/2010/11/ac',
+    'x16r2': 'http://schemas.microsoft.com/office/spreadsheetml/2015/02/main',
+    'xr': 'http://schemas.microsoft.com/office/spreadsheetml/2014/revision',
+    'xr2': 'http://schemas.microsoft.com/office/spreadsheetml/2015/revision2',
+    'xr3': 'http://schemas.microsoft.com/office/spreadsheetml/2016/revision3',
+    'xr6': 'http://schemas.microsoft.com/office/spreadsheetml/2016/revision6',
+    'xr10': 'http://schemas.microsoft.com/office/spreadsheetml/2016/revision10',
+    'vt': 'http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes',
+}.items():
+    ET.register_namespace(_prefix, _uri)
+
+_ROOT_TAG = re.compile(rb'<[A-Za-z_][^>?!]*>')
+_IGNORABLE = re.compile(rb'(\bmc:Ignorable=")([^"]*)')
+_XMLNS_PREFIX = re.compile(rb'xmlns:([\w.-]+)=')
+
+class XMLParseCache:
+    # LRU de arboles ya parseados, con clave en el digest de los bytes: los mismos rels, content types, styles o
+    # workbook.xml se repiten entre origenes y entre merges.
+    # max_bytes acota la memoria estimada de los arboles guardados: un arbol de ElementTree ocupa ~10-14 veces su XML
+    # (medido con tracemalloc en sharedStrings y hojas), asi que cada entrada cuenta len(xml) * tree_factor.
+    # Un XML que no entra en max_bytes se parsea sin hashearlo, y max_bytes=0 apaga el cache.
+    # Un XML se guarda recien la segunda vez que aparece su digest: las partes que se ven una sola vez (la mayoria en
+    # un batch de merges distintos) no desalojan a las que se repiten ni quedan retenidas
+    def __init__(self, max_bytes=8 << 20, tree_factor=14, max_seen=1024):
+        self.max_bytes = max_bytes
+        self.tree_factor = tree_factor
+        self.max_seen = max_seen
+        self.entries = OrderedDict()  # digest -> (raiz, tamaño estimado del arbol), del menos al mas usado
+        self.seen = OrderedDict()  # digests vistos una vez y todavia no guardados
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, xml_bytes, private=False):
+        # Sin private devuelve la raiz compartida, que quien la reciba no puede modificar. Con private=True devuelve
+        # un arbol propio: una copia si estaba guardado, o directamente el recien parseado si no se guarda
+        size = len(xml_bytes) * self.tree_factor
+        if not self.max_bytes or size > self.max_bytes:
+            return ET.fromstring(xml_bytes)
+        key = hashlib.blake2b(xml_bytes, digest_size=16).digest()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                admit = self.seen.pop(key, False)
+                if not admit:
+                    self.seen[key] = True
+                    if len(self.seen) > self.max_seen:
+                        self.seen.popitem(last=False)
+        if entry is not None:
+            return copy.deepcopy(entry[0]) if private else entry[0]
+        root = ET.fromstring(xml_bytes)
+        if not admit:
+            return root
+        with self._lock:
+            if key not in self.entries:
+                self.entries[key] = (root, size)
+                self.size += size
+            self._evict()
+        return copy.deepcopy(root) if private else root
+
+    def configure(self, max_bytes):
+        # Cambia el limite (0 apaga el cache) y desaloja lo que sobre
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+            if not max_bytes:
+                self.seen.clear()
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.seen.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+xml_cache = XMLParseCache()
+
+def parse_xml(path):
+    with open(path, 'rb') as f:
+        return parse_xml_bytes(f.read())
+
+def write_xml(tree, path):
+    tree.write(path, encoding="utf-8", xml_declaration=True)
 
 def parse_xml_bytes(xml_bytes):
-    tree = ET.ElementTree(ET.fromstring(xml_bytes))
+    # Arbol propio y modificable: copia del que esta en xml_cache (deepcopy cuesta ~1/5 de volver a parsear), o el
+    # recien parseado si no esta guardado
+    tree = ET.ElementTree(xml_cache.get(xml_bytes, private=True))
     return tree, tree.getroot()
 
+def parse_xml_shared(xml_bytes):
+    # Solo lectura: devuelve el arbol del cache sin copiarlo. Para cambiar un elemento hay que copiarlo antes
+    # (copy.copy y attrib = dict(attrib), copy.copy comparte el dict de atributos)
+    root = xml_cache.get(xml_bytes)
+    return ET.ElementTree(root), root
+
 def write_xml_to_bytes(tree):
     output = io.BytesIO()
     tree.write(output, encoding="utf-8", xml_declaration=True)
-    return output.getvalue()
+    return _drop_undeclared_ignorable(output.getvalue())
+
+def _drop_undeclared_ignorable(xml_bytes):
+    # ET solo declara los namespaces que se usan; un prefijo de mc:Ignorable sin declarar hace que Excel repare el archivo
+    root_tag = _ROOT_TAG.search(xml_bytes)
+    ignorable = _IGNORABLE.search(xml_bytes, root_tag.start(), root_tag.end()) if root_tag else None
+    if ignorable is None:
+        return xml_bytes
+    declared = set(_XMLNS_PREFIX.findall(root_tag.group(0)))
+    kept = b' '.join(prefix for prefix in ignorable.group(2).split() if prefix in declared)
+    return xml_bytes[:ignorable.start(2)] + kept + xml_bytes[ignorable.end(2):]
+
+def escape_attr(value):
+    return (value.replace('&', '&amp;').replace('<', '&lt;')
+                 .replace('>', '&gt;').replace('"', '&quot;'))
+
+def escape_text(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+
+def _escape_attr_value(value):
+    return escape_attr(value).replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;')
+
+# Fin de un tag de apertura respetando comillas (un > suelto es valido dentro de un valor de atributo)
+_START_TAG_END = re.compile(rb'(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
+class SheetRewriter:
+    # Reescribe una parte XML (worksheets, charts...) en streaming con expat: lee chunks, aplica callbacks
+    # y va devolviendo chunks de salida, sin armar nunca el arbol. Sirve para partes de cientos de MB.
+    # Los bytes del origen se copian tal cual y solo se reemplazan los tags y textos que un callback cambia,
+    # asi que la parte tiene que venir en UTF-8 (lo que escriben Excel y openpyxl).
+    #   attr_callbacks: {nombre local: fn(attrs) -> bool} modifica in situ los atributos, True si cambio algo
+    #   text_callbacks: {nombre local: fn(texto, attrs del padre) -> texto} para <v>, <f>...
+    def __init__(self, attr_callbacks=None, text_callbacks=None):
+        self.attr_callbacks = attr_callbacks or {}
+        self.text_callbacks = text_callbacks or {}
+
+    def rewrite(self, chunks):
+        attr_callbacks, text_callbacks = self.attr_callbacks, self.text_callbacks
+        buffer = bytearray()  # bytes del origen todavia no emitidos; buffer[0] es el offset absoluto base
+        base = 0
+        edits = []  # (inicio, fin, bytes nuevos) en offsets absolutos del origen, en orden
+        local_names = {}
+        stack = []  # attrs de los elementos abiertos
+        text = []  # (offset de inicio, partes) mientras se junta el texto de un elemento con text callback
+
+        def start(name, attrs):
+            local = local_names.get(name)
+            if local is None:
+                local = local_names[name] = name.rpartition(':')[2]
+            stack.append(attrs)
+            callback = attr_callbacks.get(local)
+            if callback is not None and callback(attrs):
+                tag_start = parser.CurrentByteIndex
+                tag_end = base + _START_TAG_END.match(buffer, tag_start - base).end()
+                closing = '/>' if buffer[tag_end - base - 2] == 0x2F else '>'
+                serialized = '<' + name + ''.join(f' {key}="{_escape_attr_value(value)}"' for key, value in attrs.items())
+                edits.append((tag_start, tag_end, (serialized + closing).encode('utf-8')))
+            if local in text_callbacks:
+                text.append([None, []])
+
+        def end(name):
+            stack.pop()
+            if not text:
+                return
+            local = local_names[name]
+            if local not in text_callbacks:
+                return
+            text_start, parts = text.pop()
+            if text_start is None:
+                return
+            old = ''.join(parts)
+            new = text_callbacks[local](old, stack[-1] if stack else {})
+            if new != old:
+                edits.append((text_start, parser.CurrentByteIndex, escape_text(new).encode('utf-8')))
+
+        def character_data(data):
+            if text:
+                entry = text[-1]
+                if entry[0] is None:
+                    entry[0] = parser.CurrentByteIndex
+                entry[1].append(data)
+
+        def start_cdata():
+            # El reemplazo tiene que cubrir tambien <![CDATA[ ... ]]>
+            if text and text[-1][0] is None:
+                text[-1][0] = parser.CurrentByteIndex
+
+        def flush(upto):
+            nonlocal base
+            out = []
+            position = base
+            done = 0
+            for edit_start, edit_end, replacement in edits:
+                if edit_end > upto:
+                    break
+                out.append(bytes(buffer[position - base:edit_start - base]))
+                out.append(replacement)
+                position = edit_end
+                done += 1
+            del edits[:done]
+            out.append(bytes(buffer[position - base:upto - base]))
+            del buffer[:upto - base]
+            base = upto
+            return b''.join(out)
+
+        parser = expat.ParserCreate()
+        parser.ordered_attributes = False
+        parser.buffer_text = False
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = character_data
+        parser.StartCdataSectionHandler = start_cdata
+
+        for chunk in chunks:
+            buffer += chunk
+            parser.Parse(chunk, False)
+            # Lo anterior a CurrentByteIndex ya se parseo; solo hay que retener el texto que un callback puede cambiar
+            safe = parser.CurrentByteIndex
+            if text and text[-1][0] is not None:
+                safe = min(safe, text[-1][0])
+            if safe > base:
+                data = flush(safe)
+                if data:
+                    yield data
+        parser.Parse(b'', True)
+        data = flush(base + len(buffer))
+        if data:
+            yield data
 
 def generate_unique_id(existing_ids, prefix="rId"):
     i = 1
     while f"{prefix}{i}" in existing_ids:
         i += 1
-    return f"{prefix}{i}"
\ No newline at end of file
+    return f"{prefix}{i}"
+
+class IdAllocator:
+    # Se siembra una vez con los ids existentes y despues entrega ids nuevos en O(1), siempre crecientes
+    def __init__(self, existing_ids=(), prefix="rId"):
+        self.prefix = prefix
+        self.next_value = 1
+        for existing_id in existing_ids:
+            self.reserve(existing_id)
+
+    def reserve(self, existing_id):
+        suffix = existing_id[len(self.prefix):]
+        if existing_id.startswith(self.prefix) and suffix.isdigit():
+            self.next_value = max(self.next_value, int(suffix) + 1)
+
+    def new_id(self):
+        value = self.next_value
+        self.next_value += 1
+        return f"{self.prefix}{value}"
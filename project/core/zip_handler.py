@@ -1,34 +1,326 @@
+import contextlib
+import threading
 import zipfile
+import struct
+import zlib
 import io
+import os
+import mmap
+import fnmatch
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from core.zip_writer import ZipWriter, deflate_part, compress_type_for
+from core.metrics import phase
+
+# Niveles pensados para salidas grandes: las hojas pesan mas que nada y con nivel 1 se comprimen varias veces
+# mas rapido; las imagenes ya vienen comprimidas y se guardan tal cual
+FAST_COMPRESSION_LEVELS = {
+    'xl/worksheets/*.xml': 1,
+    '*.png': 0,
+    '*.jpeg': 0,
+    '*.jpg': 0,
+    '*.gif': 0,
+}
+
+_RAW_COPY_TYPES = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+class ZipMember:
+    # Miembro del zip de origen; el stream comprimido se lee del buffer solo cuando hace falta
+    __slots__ = ('info', 'buffer', '_data_offset')
+
+    def __init__(self, info, buffer):
+        self.info = info
+        self.buffer = buffer
+        self._data_offset = None
+
+    def __getstate__(self):
+        # Al mandarlo a otro proceso viaja solo el stream comprimido, no el buffer del zip de origen entero
+        return self.info, bytes(self.read_raw())
+
+    def __setstate__(self, state):
+        self.info, self.buffer = state
+        self._data_offset = 0
+
+    def read_raw(self):
+        if self._data_offset is None:
+            offset = self.info.header_offset
+            if self.buffer[offset:offset + 4] != b'PK\x03\x04':
+                raise zipfile.BadZipFile(f"Bad local header for {self.info.filename}")
+            name_len, extra_len = struct.unpack('<HH', self.buffer[offset + 26:offset + 30])
+            self._data_offset = offset + 30 + name_len + extra_len
+        return memoryview(self.buffer)[self._data_offset:self._data_offset + self.info.compress_size]
+
+    def iter_chunks(self, chunk_size=1 << 16):
+        # Descomprime de a bloques para poder procesar partes enormes sin tenerlas enteras en memoria
+        raw = self.read_raw()
+        decompressor = zlib.decompressobj(-15) if self.info.compress_type == zipfile.ZIP_DEFLATED else None
+        crc = 0
+        for start in range(0, len(raw), chunk_size):
+            block = raw[start:start + chunk_size]
+            if decompressor is None:
+                chunk = bytes(block)
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+                continue
+            # XML comprime 20x o mas: se acota tambien la salida para que cada chunk pese a lo sumo chunk_size
+            while block:
+                chunk = decompressor.decompress(block, chunk_size)
+                block = decompressor.unconsumed_tail
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+        if decompressor:
+            chunk = decompressor.flush()
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        if crc != self.info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {self.info.filename!r}")
+
+    def read(self):
+        raw = self.read_raw()
+        data = zlib.decompress(raw, -15) if self.info.compress_type == zipfile.ZIP_DEFLATED else bytes(raw)
+        if zlib.crc32(data) != self.info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {self.info.filename!r}")
+        return data
+
+def _executor(workers, processes=False):
+    # zlib libera el GIL, asi que para inflar/deflatar alcanza con hilos; la reescritura de XML necesita procesos
+    return ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+
+def open_mapped(path):
+    # Mapea el archivo en solo lectura: las partes se leen de la page cache y no ocupan heap de Python,
+    # y varios procesos que abren la misma plantilla comparten esas paginas
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+@contextlib.contextmanager
+def replace_on_success(path):
+    # Abre un temporal en la misma carpeta y lo mueve sobre path recien al terminar sin errores. Escribir directo
+    # sobre path truncaria un archivo que puede estar mapeado como entrada (salida == entrada): leer de ese mmap
+    # da SIGBUS y el archivo queda destruido. Si algo falla se borra el temporal y path queda como estaba
+    path = os.fspath(path)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
 
 class ZipHandler:
-    def __init__(self, file_bytes=None):
+    def __init__(self, file_bytes=None, lazy=False, compression_levels=None, metrics=None):
+        # file_bytes puede ser bytes, un mmap o la ruta de un archivo (que se mapea en memoria)
+        self._owns_map = isinstance(file_bytes, (str, os.PathLike))
+        self.path = file_bytes if self._owns_map else None
+        if self._owns_map:
+            file_bytes = open_mapped(file_bytes)
         self.file_bytes = file_bytes
-        self.files = {}  # Dict: ruta dentro del zip -> contenido en bytes
+        self.lazy = lazy
+        self.metrics = metrics  # sink de core.metrics; con None no se mide nada
+        # Dict: patron fnmatch de la ruta -> nivel de zlib (0 = sin comprimir); gana el primer patron que coincida.
+        # Solo aplica a las partes que se comprimen al escribir; los miembros sin cambios se copian comprimidos tal cual
+        self.compression_levels = compression_levels or {}
+        self.files = {}  # Dict: ruta dentro del zip -> contenido en bytes (None si todavia no se descomprimio)
+        self.members = {}  # Dict: ruta -> ZipMember, solo mientras el contenido no cambie
+        self.streams = {}  # Dict: ruta -> funcion que genera el contenido en chunks al escribir el zip
+        self.central_dir_offset = None  # Donde empieza el directorio central del zip de origen (lo llena extract)
 
-    def extract(self):
-        with zipfile.ZipFile(io.BytesIO(self.file_bytes), 'r') as zip_ref:
+    def extract(self, workers=None):
+        # En modo lazy solo se indexa el directorio central; cada parte se descomprime en get_file_content.
+        # Con workers=N la descompresion del modo no lazy se reparte en un pool de hilos
+        with phase(self.metrics, 'extract', bytes_in=len(self.file_bytes)) as measured:
+            self._extract(workers)
+            if measured:
+                measured.parts = len(self.files)
+                measured.bytes_out = sum(len(data) for data in self.files.values() if data is not None)
+
+    def _extract(self, workers):
+        # Un mmap ya es un archivo con seek/read: el directorio central se lee del mapa sin copiarlo
+        source = self.file_bytes if isinstance(self.file_bytes, mmap.mmap) else io.BytesIO(self.file_bytes)
+        with zipfile.ZipFile(source, 'r') as zip_ref:
+            self.central_dir_offset = zip_ref.start_dir
             for zip_info in zip_ref.infolist():
-                with zip_ref.open(zip_info.filename) as file:
-                    self.files[zip_info.filename] = file.read()
+                if zip_info.compress_type in _RAW_COPY_TYPES and not zip_info.flag_bits & 0x1:
+                    self.members[zip_info.filename] = ZipMember(zip_info, self.file_bytes)
+                    self.files[zip_info.filename] = None
+                else:
+                    self.files[zip_info.filename] = zip_ref.read(zip_info)
+        if self.lazy:
+            return
+        if workers and workers > 1:
+            with _executor(workers) as pool:
+                for path, data in zip(self.members, pool.map(ZipMember.read, self.members.values())):
+                    self.files[path] = data
+        else:
+            for path, member in self.members.items():
+                self.files[path] = member.read()
 
-    def create_zip_bytes(self):
+    def create_zip_bytes(self, workers=None, processes=False):
         output = io.BytesIO()
-        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for path, data in self.files.items():
-                zipf.writestr(path, data)
-        output.seek(0)
-        return output.read()
+        self.write_to(output, workers, processes)
+        return output.getvalue()
+
+    def write_to(self, target, workers=None, processes=False):
+        # Escribe miembro por miembro; target puede ser una ruta o cualquier objeto con write() (archivo, socket, respuesta HTTP)
+        if isinstance(target, (str, os.PathLike)):
+            with replace_on_success(target) as f:
+                return self.write_to(f, workers, processes)
+        writer = ZipWriter(target)
+        with phase(self.metrics, 'write_zip') as measured:
+            if workers and workers > 1:
+                with _executor(workers, processes) as pool:
+                    self._write_parallel(writer, pool, workers)
+            else:
+                self._write_serial(writer)
+            writer.close()
+            if measured:
+                measured.parts = len(writer.entries)
+                measured.bytes_in = sum(entry[7] for entry in writer.entries)
+                measured.bytes_out = writer.offset
+
+    def append_to(self, base, workers=None, processes=False):
+        # Agrega sobre el archivo de base (un ZipHandler abierto desde una ruta y ya extraido) solo lo que cambio:
+        # los miembros que siguen siendo los de base quedan donde estan, el resto se escribe al final del archivo
+        # (despues del fin de directorio central viejo) y detras va un directorio central nuevo. Los lectores usan el
+        # ultimo fin de directorio central, asi que el paquete viejo sigue siendo valido hasta que se escribe el nuevo;
+        # las partes se sincronizan a disco antes de escribirlo. Si el proceso muere a mitad de camino, truncar el
+        # archivo a su tamaño anterior lo deja como estaba. El directorio viejo y las versiones reemplazadas de las
+        # partes quedan como bytes muertos. Ante una excepcion se trunca al tamaño original
+        if base.path is None or base.central_dir_offset is None:
+            raise ValueError("append_to needs an extracted ZipHandler opened from a path")
+        in_place = {path for path, member in self.members.items()
+                    if member.buffer is base.file_bytes and member.info.filename == path}
+        with open(base.path, 'r+b') as f:
+            start = f.seek(0, os.SEEK_END)
+            writer = ZipWriter(f, offset=start)
+            try:
+                with phase(self.metrics, 'append_zip') as measured:
+                    if workers and workers > 1:
+                        with _executor(workers, processes) as pool:
+                            self._write_parallel(writer, pool, workers, in_place)
+                    else:
+                        self._write_serial(writer, in_place)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    writer.close()
+                    f.flush()
+                    os.fsync(f.fileno())
+                    if measured:
+                        measured.parts = len(writer.entries) - len(in_place)
+                        measured.bytes_out = writer.offset - start
+            except BaseException:
+                f.truncate(start)
+                raise
+
+    def _write_serial(self, writer, in_place=()):
+        # in_place: rutas que ya estan escritas en el archivo de salida (modo append) y solo van al directorio central
+        for path, data in self.files.items():
+            member = self.members.get(path)
+            if path in in_place:
+                writer.add_existing(member.info)
+            elif member is not None:
+                info = member.info
+                writer.write_raw(path, member.read_raw(), info.CRC, info.file_size, info.compress_type, info.date_time)
+            elif path in self.streams:
+                factory = self.streams[path]
+                writer.write_stream(path, factory(), self.compression_level(path), getattr(factory, 'size_hint', None))
+            else:
+                level = self.compression_level(path)
+                writer.write_bytes(path, data, compress_type_for(level), level)
+
+    def compression_level(self, path):
+        for pattern, level in self.compression_levels.items():
+            if fnmatch.fnmatchcase(path, pattern):
+                return level
+        return zlib.Z_DEFAULT_COMPRESSION
+
+    def _write_parallel(self, writer, pool, workers, in_place=()):
+        # Las partes nuevas o reescritas se comprimen en el pool y se escriben en el orden de self.files, asi la
+        # salida tiene el mismo orden que la serie. La ventana acota cuantas partes comprimidas quedan esperando en memoria
+        pending = deque()
+        for path, data in self.files.items():
+            member = self.members.get(path)
+            if member is not None:
+                pending.append((path, member, None, path in in_place))
+            else:
+                part = self.streams[path] if path in self.streams else data
+                pending.append((path, None, pool.submit(deflate_part, part, self.compression_level(path)), False))
+            while len(pending) > 2 * workers:
+                self._write_pending(writer, *pending.popleft())
+        while pending:
+            self._write_pending(writer, *pending.popleft())
 
-    def get_file_content(self, path):
-        return self.files.get(path)
+    def _write_pending(self, writer, path, member, future, in_place):
+        if in_place:
+            writer.add_existing(member.info)
+        elif member is not None:
+            info = member.info
+            writer.write_raw(path, member.read_raw(), info.CRC, info.file_size, info.compress_type, info.date_time)
+        else:
+            raw, crc, file_size, compress_type = future.result()
+            writer.write_raw(path, raw, crc, file_size, compress_type)
+
+    def get_file_content(self, path, cache=True):
+        data = self.files.get(path)
+        if data is None and path in self.members:
+            data = self.members[path].read()
+            if cache:
+                self.files[path] = data
+        elif data is None and path in self.streams:
+            data = b''.join(self.streams[path]())
+        return data
+
+    def iter_file_chunks(self, path):
+        data = self.files.get(path)
+        if data is not None:
+            yield data
+        elif path in self.members:
+            yield from self.members[path].iter_chunks()
+        elif path in self.streams:
+            yield from self.streams[path]()
+
+    def get_file_checksum(self, path):
+        # (CRC-32, tamaño) sin descomprimir si la parte sigue siendo la del zip de origen
+        member = self.members.get(path)
+        if member is not None:
+            return member.info.CRC, member.info.file_size
+        data = self.get_file_content(path, cache=False)
+        return zlib.crc32(data), len(data)
 
     def set_file_content(self, path, data):
+        self.members.pop(path, None)
+        self.streams.pop(path, None)
         self.files[path] = data
 
+    def set_file_stream(self, path, chunk_factory):
+        # chunk_factory() se llama recien al escribir el zip y devuelve un iterable de bytes; si tiene un atributo
+        # size_hint (tamaño aproximado sin comprimir) se usa para decidir Zip64 antes de escribir el header
+        self.members.pop(path, None)
+        self.streams[path] = chunk_factory
+        self.files[path] = None
+
+    def copy_file_from(self, other, src_path, dst_path=None):
+        dst_path = dst_path or src_path
+        self.files[dst_path] = other.files[src_path]
+        self.members.pop(dst_path, None)
+        self.streams.pop(dst_path, None)
+        if src_path in other.members:
+            self.members[dst_path] = other.members[src_path]
+        elif src_path in other.streams:
+            self.streams[dst_path] = other.streams[src_path]
+
+    def close(self):
+        # Solo cierra el mapa si lo abrio este handler; las partes copiadas a otro ZipHandler dejan de poder leerse
+        if self._owns_map:
+            self.file_bytes.close()
+            self._owns_map = False
+
     def list_files(self):
         return list(self.files.keys())
 
     def remove_file(self, path):
+        self.members.pop(path, None)
+        self.streams.pop(path, None)
         if path in self.files:
-            del self.files[path]
\ No newline at end of file
+            del self.files[path]
@@ -0,0 +1,162 @@
+import struct
+import time
+import zipfile
+import zlib
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+_END_OF_CENTRAL_DIR = struct.Struct('<4sHHHHIIH')
+_DATA_DESCRIPTOR = struct.Struct('<4sIII')
+_DATA_DESCRIPTOR64 = struct.Struct('<4sIQQ')
+_ZIP64_END_OF_CENTRAL_DIR = struct.Struct('<4sQHHIIQQQQ')
+_ZIP64_END_LOCATOR = struct.Struct('<4sIQI')
+
+_VERSION = 20
+_ZIP64_VERSION = 45
+_ZIP64_EXTRA_ID = 0x0001
+_MAX32 = 0xFFFFFFFF
+_MAX16 = 0xFFFF
+# A partir de estos valores un campo ya no entra en los headers clasicos y va en el extra Zip64
+ZIP64_LIMIT = _MAX32
+ZIP_FILECOUNT_LIMIT = _MAX16
+_UTF8_FLAG = 0x800
+_DATA_DESCRIPTOR_FLAG = 0x08
+_EXTERNAL_ATTR = 0o600 << 16
+
+def deflate(data, level=zlib.Z_DEFAULT_COMPRESSION):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def compress_type_for(level):
+    # Nivel 0 se guarda sin comprimir (ZIP_STORED); cualquier otro nivel es deflate
+    return zipfile.ZIP_STORED if level == 0 else zipfile.ZIP_DEFLATED
+
+def deflate_part(part, level=zlib.Z_DEFAULT_COMPRESSION):
+    # Comprime una parte entera fuera del hilo que escribe el zip; part son bytes o una funcion que genera chunks.
+    # Devuelve (stream comprimido, CRC-32, tamaño, metodo) listo para write_raw
+    chunks = part() if callable(part) else (part,)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if level != 0 else None
+    crc = file_size = 0
+    raw = []
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        file_size += len(chunk)
+        raw.append(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        raw.append(compressor.flush())
+    return b''.join(raw), crc, file_size, compress_type_for(level)
+
+def _zip64_extra(*values):
+    return struct.pack(f'<HH{len(values)}Q', _ZIP64_EXTRA_ID, 8 * len(values), *values)
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    dos_date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+
+class ZipWriter:
+    # Escritor de zip minimo que acepta miembros ya comprimidos, asi los que no cambian se copian tal cual.
+    # Pasa a Zip64 solo donde hace falta (miembros o offsets de 4 GB o mas, mas de 65535 miembros), asi que
+    # los paquetes normales salen identicos a un zip clasico
+    def __init__(self, fileobj, offset=0):
+        # offset es la posicion de fileobj donde se empieza a escribir (> 0 al agregar sobre un zip existente)
+        self.fp = fileobj
+        self.offset = offset
+        self.entries = []
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.offset += len(data)
+
+    def write_raw(self, name, raw, crc, file_size, compress_type, date_time=None):
+        name_bytes = name.encode('utf-8')
+        flags = 0 if name_bytes.isascii() else _UTF8_FLAG
+        dos_time, dos_date = _dos_datetime(date_time or time.localtime())
+        compress_size = len(raw)
+        zip64 = file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT
+        extra = _zip64_extra(file_size, compress_size) if zip64 else b''
+        entry = (name_bytes, flags, compress_type, dos_time, dos_date, crc, compress_size, file_size, self.offset, zip64)
+        self._write(_LOCAL_HEADER.pack(b'PK\x03\x04', _ZIP64_VERSION if zip64 else _VERSION, flags, compress_type,
+                                       dos_time, dos_date, crc, _MAX32 if zip64 else compress_size,
+                                       _MAX32 if zip64 else file_size, len(name_bytes), len(extra)))
+        self._write(name_bytes)
+        self._write(extra)
+        self._write(raw)
+        self.entries.append(entry)
+
+    def add_existing(self, info):
+        # Modo append: el miembro ya esta escrito en el archivo en info.header_offset; solo entra al directorio central.
+        # El nombre y los flags tienen que coincidir con los del header local que quedo en el archivo
+        name_bytes = info.filename.encode('utf-8' if info.flag_bits & _UTF8_FLAG else 'cp437')
+        dos_time, dos_date = _dos_datetime(info.date_time)
+        self.entries.append((name_bytes, info.flag_bits, info.compress_type, dos_time, dos_date, info.CRC,
+                             info.compress_size, info.file_size, info.header_offset,
+                             info.extract_version >= _ZIP64_VERSION))
+
+    def write_bytes(self, name, data, compress_type=zipfile.ZIP_DEFLATED, level=zlib.Z_DEFAULT_COMPRESSION):
+        raw = deflate(data, level) if compress_type == zipfile.ZIP_DEFLATED else data
+        self.write_raw(name, raw, zlib.crc32(data), len(data), compress_type)
+
+    def write_stream(self, name, chunks, level=zlib.Z_DEFAULT_COMPRESSION, size_hint=None):
+        # Para partes generadas al vuelo: CRC y tamaños se conocen al final y van en un data descriptor.
+        # Un miembro STORED con data descriptor no se puede leer en streaming, asi que nivel 0 se arma en memoria.
+        # Como el header local se escribe antes de conocer el tamaño, size_hint decide si el miembro va en Zip64
+        # (con el mismo margen que zipfile); sin hint, pasarse de 4 GB es un error
+        if level == 0:
+            return self.write_bytes(name, b''.join(chunks), zipfile.ZIP_STORED)
+        name_bytes = name.encode('utf-8')
+        flags = _DATA_DESCRIPTOR_FLAG | (0 if name_bytes.isascii() else _UTF8_FLAG)
+        dos_time, dos_date = _dos_datetime(time.localtime())
+        zip64 = size_hint is not None and size_hint * 1.05 >= ZIP64_LIMIT
+        extra = _zip64_extra(0, 0) if zip64 else b''
+        header_offset = self.offset
+        self._write(_LOCAL_HEADER.pack(b'PK\x03\x04', _ZIP64_VERSION if zip64 else _VERSION, flags, zipfile.ZIP_DEFLATED,
+                                       dos_time, dos_date, 0, _MAX32 if zip64 else 0, _MAX32 if zip64 else 0,
+                                       len(name_bytes), len(extra)))
+        self._write(name_bytes)
+        self._write(extra)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        crc = file_size = 0
+        data_start = self.offset
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            self._write(compressor.compress(chunk))
+        self._write(compressor.flush())
+        compress_size = self.offset - data_start
+        if not zip64 and (file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT):
+            raise zipfile.LargeZipFile(f"{name} exceeded 4 GB without a size_hint; ZIP64 must be decided up front")
+        descriptor = _DATA_DESCRIPTOR64 if zip64 else _DATA_DESCRIPTOR
+        self._write(descriptor.pack(b'PK\x07\x08', crc, compress_size, file_size))
+        self.entries.append((name_bytes, flags, zipfile.ZIP_DEFLATED, dos_time, dos_date, crc,
+                             compress_size, file_size, header_offset, zip64))
+
+    def close(self):
+        central_dir_offset = self.offset
+        for name_bytes, flags, compress_type, dos_time, dos_date, crc, compress_size, file_size, offset, zip64 in self.entries:
+            # El extra Zip64 del directorio central lleva, en este orden, solo los campos que no entran en 32 bits
+            large = [value for value in (file_size, compress_size, offset) if value >= ZIP64_LIMIT]
+            extra = _zip64_extra(*large) if large else b''
+            version = _ZIP64_VERSION if large or zip64 else _VERSION
+            self._write(_CENTRAL_HEADER.pack(b'PK\x01\x02', version | 3 << 8, version, flags, compress_type,
+                                             dos_time, dos_date, crc,
+                                             _MAX32 if compress_size >= ZIP64_LIMIT else compress_size,
+                                             _MAX32 if file_size >= ZIP64_LIMIT else file_size,
+                                             len(name_bytes), len(extra), 0, 0, 0, _EXTERNAL_ATTR,
+                                             _MAX32 if offset >= ZIP64_LIMIT else offset))
+            self._write(name_bytes)
+            self._write(extra)
+        central_dir_size = self.offset - central_dir_offset
+        count = len(self.entries)
+        if count >= ZIP_FILECOUNT_LIMIT or central_dir_offset >= ZIP64_LIMIT or central_dir_size >= ZIP64_LIMIT:
+            zip64_end_offset = self.offset
+            self._write(_ZIP64_END_OF_CENTRAL_DIR.pack(b'PK\x06\x06', _ZIP64_END_OF_CENTRAL_DIR.size - 12,
+                                                       _ZIP64_VERSION, _ZIP64_VERSION, 0, 0, count, count,
+                                                       central_dir_size, central_dir_offset))
+            self._write(_ZIP64_END_LOCATOR.pack(b'PK\x06\x07', 0, zip64_end_offset, 1))
+            count = min(count, _MAX16)
+            central_dir_size = min(central_dir_size, _MAX32)
+            central_dir_offset = min(central_dir_offset, _MAX32)
+        self._write(_END_OF_CENTRAL_DIR.pack(b'PK\x05\x06', 0, 0, count, count,
+                                             central_dir_size, central_dir_offset, 0))
@@ -1,11 +1,19 @@
 # main.py
-from pathlib import Path
+import argparse
+import csv
+import json
+import os
+import sys
+import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 from core.xlsx_merger import XLSXMerger
+from core.zip_handler import FAST_COMPRESSION_LEVELS
+from core.metrics import MergeMetrics
+from core.validator import validate_package
+from core.xml_utils import xml_cache
 
-file_A= 'project/examples/Example A.xlsx'
-file_B= 'project/examples/Example B.xlsx'
-file_C= 'project/examples/Example C.xlsx' # With images
 
 def descomprimir_xlsx(ruta_xlsx, carpeta_destino):
     Path(carpeta_destino).mkdir(parents=True, exist_ok=True)
@@ -14,34 +22,123 @@ def descomprimir_xlsx(ruta_xlsx, carpeta_destino):
     print(f"✅ Extraído en: {carpeta_destino}")
 
 
-def main():
-    # Cargar los archivos de entrada
-    with open(file_A, "rb") as f:
-        file_a_bytes = f.read()
+def leer_manifiesto(ruta):
+    # JSON: {"salida.xlsx": ["a.xlsx", "b.xlsx"]} o [{"output": ..., "inputs": [...]}]
+    # CSV: una fila por salida (salida,entrada1,entrada2,...) o varias filas salida,entrada que se agrupan en orden.
+    # Las rutas relativas se resuelven contra la carpeta del manifiesto
+    ruta = Path(ruta)
+    jobs = {}
+    if ruta.suffix.lower() == '.csv':
+        with open(ruta, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                row = [cell.strip() for cell in row if cell.strip()]
+                if len(row) < 2 or row[0].startswith('#') or row[0].lower() == 'output':
+                    continue
+                jobs.setdefault(row[0], []).extend(row[1:])
+    else:
+        with open(ruta, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = [{'output': output, 'inputs': inputs} for output, inputs in data.items()]
+        for job in data:
+            jobs.setdefault(job['output'], []).extend(job['inputs'])
 
-    with open(file_C, "rb") as f:
-        file_b_bytes = f.read()
+    base = ruta.parent
+    return [(str(base / output), [str(base / source) for source in inputs]) for output, inputs in jobs.items()]
 
-    # Crear el merger
-    merger = XLSXMerger(file_a_bytes, file_b_bytes)
 
-    # Ejecutar el merge
-    merged_file_bytes = merger.merge()
+def configurar_cache_xml(max_bytes):
+    # Initializer del pool: cada worker tiene su propio xml_cache
+    xml_cache.configure(max_bytes)
 
-    # Guardar el archivo resultante
-    with open("merged_output.xlsx", "wb") as f:
-        f.write(merged_file_bytes)
 
-    print("Archivo merged_output.xlsx generado exitosamente!")
+def ejecutar_merge(output, inputs, merge_workers=None, compression_levels=None, phases=False, append=False,
+                   validate=False):
+    # Corre en los workers del pool; las entradas se pasan como rutas y ZipHandler las mapea en memoria (mmap).
+    # Con append y una salida que ya existe, las entradas se agregan a esa salida sin reescribirla
+    start = time.perf_counter()
+    metrics = MergeMetrics() if phases else None
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    if append and os.path.exists(output):
+        XLSXMerger.append_many(output, inputs,
+                               workers=merge_workers, compression_levels=compression_levels, metrics=metrics)
+    else:
+        XLSXMerger.merge_many(inputs, output,
+                              workers=merge_workers, compression_levels=compression_levels, metrics=metrics)
+    result = {'output': output, 'inputs': len(inputs), 'seconds': round(time.perf_counter() - start, 4),
+              'bytes': os.path.getsize(output)}
+    if metrics is not None:
+        result['phases'] = metrics.to_dict()
+    if validate:
+        result['validation'] = validate_package(output).to_dict()
+    return result
 
-    descomprimir_xlsx(
-            ruta_xlsx="merged_output.xlsx",
-            carpeta_destino="merged_output.xlsx".replace('.xlsx', '')
-        )
-    import shutil
-    shutil.copy2("merged_output.xlsx", "merged_output.xlsx".replace('.xlsx', '.zip'))
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Combina las hojas de varios .xlsx en un solo libro.")
+    parser.add_argument('manifest', nargs='?', help="Manifiesto JSON o CSV con salida -> lista de entradas")
+    parser.add_argument('-o', '--output', help="Salida de un merge suelto (sin manifiesto)")
+    parser.add_argument('-i', '--inputs', nargs='+', help="Entradas de un merge suelto; la primera es la base")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="Merges en paralelo")
+    parser.add_argument('--merge-workers', type=int, help="Workers dentro de cada merge (ver XLSXMerger)")
+    parser.add_argument('--fast', action='store_true', help="Nivel 1 para hojas e imagenes sin comprimir")
+    parser.add_argument('--append', action='store_true',
+                        help="Si la salida ya existe, agrega las entradas sin reescribir lo que ya tiene")
+    parser.add_argument('--validate', action='store_true',
+                        help="Valida relaciones y content types de cada salida; un paquete invalido cuenta como fallo")
+    parser.add_argument('--xml-cache-mb', type=float,
+                        help="Memoria estimada para arboles XML ya parseados en cada worker (0 lo apaga)")
+    parser.add_argument('--report', help="Escribe los tiempos por trabajo en este JSON")
+    parser.add_argument('--phases', action='store_true', help="Incluye en el reporte el detalle por fase de cada merge")
+    parser.add_argument('--extract', action='store_true', help="Debug: descomprime cada salida en una carpeta")
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
-    main()
+    if args.manifest:
+        jobs = leer_manifiesto(args.manifest)
+    elif args.output and args.inputs:
+        jobs = [(args.output, args.inputs)]
+    else:
+        parser.error("hace falta un manifiesto o --output con --inputs")
+
+    compression_levels = FAST_COMPRESSION_LEVELS if args.fast else None
+    results, failures = [], 0
+    start = time.perf_counter()
+    initializer, initargs = None, ()
+    if args.xml_cache_mb is not None:
+        initializer, initargs = configurar_cache_xml, (int(args.xml_cache_mb * (1 << 20)),)
+    with ProcessPoolExecutor(max(1, min(args.jobs, len(jobs))), initializer=initializer,
+                             initargs=initargs) as pool:
+        futures = {pool.submit(ejecutar_merge, output, inputs, args.merge_workers, compression_levels,
+                               args.phases, args.append, args.validate): output
+                   for output, inputs in jobs}
+        for future in as_completed(futures):
+            output = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                result = {'output': output, 'error': f"{type(e).__name__}: {e}"}
+                print(f"❌ {output}: {result['error']}", file=sys.stderr)
+            else:
+                issues = result.get('validation', {}).get('issues')
+                if issues:
+                    failures += 1
+                    print(f"❌ {output}: {len(issues)} problemas de validacion", file=sys.stderr)
+                    for issue in issues:
+                        print(f"   {issue['code']}: {issue['message']}", file=sys.stderr)
+                else:
+                    print(f"✅ {output} ({result['inputs']} entradas, {result['seconds']:.3f}s)")
+                if args.extract:
+                    descomprimir_xlsx(output, output.replace('.xlsx', ''))
+            results.append(result)
 
+    total = time.perf_counter() - start
+    print(f"{len(jobs) - failures}/{len(jobs)} merges en {total:.3f}s")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'seconds': round(total, 4), 'jobs': results}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
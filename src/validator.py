@@ -1,71 +1,47 @@
-import zipfile
-import xml.etree.ElementTree as ET
+import argparse
+import json
+import sys
 from pathlib import Path
-import tempfile
-import os
 
-def validar_relaciones_excel(ruta_xlsx):
-    errores = []
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmpdir = Path(tmpdir)
-        with zipfile.ZipFile(ruta_xlsx, 'r') as zip_ref:
-            zip_ref.extractall(tmpdir)
-
-        # Buscar todos los r:id en sheetX.xml
-        sheet_ids = {}
-        sheets_dir = tmpdir / "xl" / "worksheets"
-        for sheet_file in sheets_dir.glob("sheet*.xml"):
-            try:
-                tree = ET.parse(sheet_file)
-                for drawing in tree.getroot().findall(".//{*}drawing"):
-                    r_id = drawing.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id")
-                    if r_id:
-                        sheet_ids[sheet_file.name] = r_id
-            except ET.ParseError:
-                errores.append(f"❌ Error parseando {sheet_file.name}")
-
-        # Revisar que esos r:id existan en sheetX.xml.rels
-        for sheet_file, r_id in sheet_ids.items():
-            rels_file = sheets_dir / "_rels" / f"{sheet_file}.rels"
-            if not rels_file.exists():
-                errores.append(f"❌ Falta archivo de relaciones: {sheet_file}.rels")
-                continue
-
-            try:
-                tree = ET.parse(rels_file)
-                ids_encontrados = [rel.attrib['Id'] for rel in tree.findall(".//{*}Relationship")]
-                if r_id not in ids_encontrados:
-                    errores.append(f"❌ {sheet_file} referencia r:id={r_id}, pero no está en su .rels")
-            except ET.ParseError:
-                errores.append(f"❌ Error parseando relaciones de {sheet_file}")
+# La validacion vive en project/core/validator.py: trabaja sobre el zip en memoria, sin extraer a un directorio
+# temporal, y revisa todas las relaciones (no solo el ultimo drawing de cada hoja)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'project'))
+from core.validator import validate_package, validate_directory
 
-        # Validar workbook.xml y workbook.xml.rels
-        workbook_xml = tmpdir / "xl" / "workbook.xml"
-        workbook_rels = tmpdir / "xl" / "_rels" / "workbook.xml.rels"
-        if workbook_xml.exists() and workbook_rels.exists():
-            try:
-                wb_tree = ET.parse(workbook_xml)
-                wb_root = wb_tree.getroot()
-                wb_rids = [sheet.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id")
-                           for sheet in wb_root.findall(".//{*}sheet") if sheet.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id")]
-
-                rel_tree = ET.parse(workbook_rels)
-                rel_root = rel_tree.getroot()
-                rel_ids = [rel.attrib["Id"] for rel in rel_root.findall(".//{*}Relationship")]
-
-                for rid in wb_rids:
-                    if rid not in rel_ids:
-                        errores.append(f"❌ workbook.xml referencia r:id={rid}, pero no está en workbook.xml.rels")
-            except ET.ParseError:
-                errores.append("❌ Error parseando workbook.xml o su .rels")
-
-    if errores:
+def validar_relaciones_excel(ruta_xlsx):
+    # Devuelve el ValidationResult ademas de imprimirlo
+    resultado = validate_package(ruta_xlsx)
+    if resultado.issues:
         print("\n🔍 Validación terminada con errores:")
-        for err in errores:
-            print(err)
+        for issue in resultado.issues:
+            print(f"❌ {issue.code}: {issue.message}")
     else:
         print("✅ Todas las relaciones r:id están bien referenciadas.")
+    return resultado
+
+def validar_carpeta(carpeta, workers=None, patron='*.xlsx', reporte=None, completo=False):
+    # Valida todos los libros de la carpeta en paralelo; con completo=False cada libro se corta en el primer error
+    resumen = validate_directory(carpeta, patron, workers, stop_on_error=not completo)
+    for resultado in resumen['results']:
+        if not resultado['ok']:
+            print(f"❌ {resultado['path']}: {resultado['issues'][0]['message']}", file=sys.stderr)
+    print(f"{resumen['valid']}/{resumen['files']} libros válidos en {resumen['seconds']:.3f}s")
+    if reporte:
+        with open(reporte, 'w', encoding='utf-8') as f:
+            json.dump(resumen, f, indent=2)
+    return resumen
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Valida relaciones y content types de un .xlsx o de una carpeta.")
+    parser.add_argument('ruta', help="Un .xlsx, o una carpeta que se recorre recursivamente")
+    parser.add_argument('-j', '--workers', type=int, help="Procesos para validar una carpeta (por defecto, uno por CPU)")
+    parser.add_argument('--pattern', default='*.xlsx', help="Patron de los archivos a validar dentro de la carpeta")
+    parser.add_argument('--report', help="Escribe el resumen de la carpeta en este JSON")
+    parser.add_argument('--full', action='store_true', help="Lista todos los errores de cada libro, no solo el primero")
+    args = parser.parse_args(argv)
+    if Path(args.ruta).is_dir():
+        return 1 if validar_carpeta(args.ruta, args.workers, args.pattern, args.report, args.full)['invalid'] else 0
+    return 0 if validar_relaciones_excel(args.ruta).ok else 1
 
-# Ejemplo de uso
 if __name__ == '__main__':
-    validar_relaciones_excel("Output.xlsx")
+    sys.exit(main())